@@ -0,0 +1,125 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# A copy of the GNU General Public License can be found at
+# <https://www.gnu.org/licenses/>.
+
+# Pipeline benchmark for pdf2csv.py. Writes a synthetic corpus with benchmarks/synthetic_statements.py (nothing is downloaded
+# and no real statements are needed), then times each stage over it and reports files/sec, rows/sec and peak memory:
+#   classify - opening a PDF and pdfplumber_extract_from_pdf
+#   extract  - the extract_* function for the statement type
+#   post     - post_extraction_processing over every extracted table
+# Save a run with --save and compare later runs against it with --compare to catch regressions.
+# Usage: python benchmarks/pipeline.py [--count 30] [--pages 2] [--transactions 40] [--save baseline.json] [--compare baseline.json]
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic_statements
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_pdf2csv(work_dir): # pdf2csv reads its folder settings from mysecrets.py, so a throwaway one is written for the benchmark
+    with open(os.path.join(work_dir, "mysecrets.py"), "w") as secrets_file:
+        secrets_file.write(f"PDF_DIR = {work_dir!r}\nCSV_FILE = 'pipeline_benchmark'\n")
+    sys.path[:0] = [repo_dir, work_dir]
+    import pdf2csv
+    return pdf2csv
+
+def run_stages(pdf2csv, paths, account_engine): # Runs every stage over the corpus and returns {stage: (seconds, files, rows, peak bytes)}
+    extractors = {
+        "account": pdf2csv.extract_account_tables_with_pdfplumber if account_engine == "pdfplumber" else pdf2csv.extract_account_tables_with_camelot,
+        "credit": pdf2csv.extract_credit_tables_with_camelot,
+        "credit_line": pdf2csv.extract_credit_line_tables_with_pdfplumber,
+    }
+    assemblers = {detector["type"]: detector["assembler"] for detector in pdf2csv.statement_detectors}
+
+    def extract(statement_type, document, year, year2, account_number): # Reads the page tables and assembles them into transactions, as convert_pdf does
+        tables = extractors[statement_type](document, year, year2, account_number)
+        return assemblers[statement_type](tables, year, year2, account_number) if tables else []
+    totals = {stage: [0.0, 0, 0, 0] for stage in ["classify", "extract", "post"]}
+    tracing = tracemalloc.is_tracing()
+
+    def measure(stage, function, *args): # Times one call and keeps the stage's highest traced memory peak
+        if tracing:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function(*args)
+        totals[stage][0] += time.perf_counter() - start
+        totals[stage][1] += 1
+        if tracing:
+            totals[stage][3] = max(totals[stage][3], tracemalloc.get_traced_memory()[1])
+        return result
+
+    dataframes = []
+    for path in paths:
+        with pdf2csv.StatementDocument(path) as document:
+            year, year2, account_number, statement_type, _ = measure("classify", pdf2csv.pdfplumber_extract_from_pdf, document)
+            if statement_type in extractors:
+                tables = measure("extract", extract, statement_type, document, year, year2, account_number)
+                totals["extract"][2] += sum(len(table) for table in tables)
+                dataframes.extend(tables)
+    if dataframes:
+        totals["post"][2] = len(measure("post", pdf2csv.post_extraction_processing, dataframes))
+        totals["post"][1] = len(paths)
+    return {stage: tuple(values) for stage, values in totals.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pdf2csv.py stages on a synthetic corpus")
+    parser.add_argument("--count", type=int, default=30, help="Number of statements, split evenly between the three types")
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--transactions", type=int, default=40)
+    parser.add_argument("--multiline", type=float, default=0.25, help="Fraction of transactions with a continuation line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--account-engine", default="camelot", choices=["camelot", "pdfplumber"])
+    parser.add_argument("--no-memory", action="store_true", help="Skip the second pass that traces peak memory")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Fail when a stage is slower than in this saved JSON file by more than --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = synthetic_statements.write_corpus(os.path.join(work_dir, "statements"), args.count, args.pages, args.transactions, args.multiline, args.seed)
+        pdf2csv = import_pdf2csv(work_dir)
+        pdf2csv.configure_logging()
+        timings = run_stages(pdf2csv, paths, args.account_engine)
+        memory = {}
+        if not args.no_memory: # Traced separately since tracemalloc slows everything down
+            tracemalloc.start()
+            memory = {stage: values[3] for stage, values in run_stages(pdf2csv, paths, args.account_engine).items()}
+            tracemalloc.stop()
+
+    results = {}
+    print(f"{len(paths)} statements, {args.pages} pages and {args.transactions} transactions each")
+    print(f"{'stage':<10}{'seconds':>9}{'files/s':>10}{'rows/s':>10}{'peak MB':>9}")
+    for stage, (seconds, files, rows, _) in timings.items():
+        results[stage] = {"seconds": round(seconds, 4), "files_per_sec": round(files / seconds, 2) if seconds else None, "rows_per_sec": round(rows / seconds, 1) if seconds else None, "peak_mb": round(memory[stage] / 1024 / 1024, 2) if stage in memory else None}
+        peak = f"{results[stage]['peak_mb']:>9.1f}" if stage in memory else f"{'-':>9}"
+        print(f"{stage:<10}{seconds:>9.2f}{results[stage]['files_per_sec'] or 0:>10.1f}{results[stage]['rows_per_sec'] or 0:>10.0f}{peak}")
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump({"settings": vars(args), "stages": results}, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["stages"]
+        regressions = [stage for stage, values in results.items() if baseline.get(stage, {}).get("files_per_sec") and values["files_per_sec"] is not None and values["files_per_sec"] < baseline[stage]["files_per_sec"] * (1 - args.tolerance)]
+        for stage in regressions:
+            print(f"{stage} regressed: {results[stage]['files_per_sec']} files/s against {baseline[stage]['files_per_sec']} in {args.compare}")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
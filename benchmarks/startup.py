@@ -0,0 +1,98 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# A copy of the GNU General Public License can be found at
+# <https://www.gnu.org/licenses/>.
+
+# Startup benchmark for pdf2csv.py. Times three things in fresh interpreters and fails when a median goes over its budget:
+#   import       - python starting up and importing pdf2csv
+#   no-op run    - a full process_pdfs() run over a folder with no PDFs in it
+#   worker start - a spawned worker process importing pdf2csv and returning its first result
+# It also checks that discovery doesn't follow a folder link back up the tree round in circles
+# Usage: python benchmarks/startup.py [--repeat 5]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+budgets = {"import": 1.0, "no-op run": 1.5, "worker start": 2.0} # Seconds, compared against the median of the repeats
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+worker_start_code = """
+import time, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pdf2csv
+if __name__ == "__main__":
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=pdf2csv.configure_logging) as executor: # Spawn, so the worker imports pdf2csv from scratch like it does on Windows
+        executor.submit(pdf2csv.configure_logging).result()
+    print(time.perf_counter() - start)
+"""
+
+def run_python(code, work_dir): # Returns the wall time of a fresh interpreter running the code, or the time it reports itself
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([repo_dir, work_dir]))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=work_dir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    reported = result.stdout.strip().splitlines()
+    return float(reported[-1]) if reported and reported[-1].replace(".", "", 1).isdigit() else elapsed
+
+discovery_loop_code = """
+import os, pdf2csv
+found = list(pdf2csv.get_pdf_files_recursive(os.path.abspath("linked")))
+print(len(found))
+"""
+
+def check_discovery_loop(work_dir): # One PDF next to a link to its own folder must be found exactly once. Returns False when it isn't, None when symlinks can't be created
+    pdf_dir = os.path.join(work_dir, "linked")
+    os.makedirs(pdf_dir)
+    with open(os.path.join(pdf_dir, "statement.pdf"), "wb") as pdf_file:
+        pdf_file.write(b"%PDF-1.4\n")
+    try:
+        os.symlink(pdf_dir, os.path.join(pdf_dir, "loop"), target_is_directory=True)
+    except OSError: # Creating symlinks needs extra privileges on Windows
+        return None
+    return run_python(discovery_loop_code, work_dir) == 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure pdf2csv.py start-up time against a budget")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        pdf_dir = os.path.join(work_dir, "pdfs")
+        os.makedirs(pdf_dir)
+        with open(os.path.join(work_dir, "mysecrets.py"), "w") as secrets_file: # An empty statement folder, so nothing is parsed
+            secrets_file.write(f"PDF_DIR = {pdf_dir!r}\nCSV_FILE = 'startup_benchmark'\n")
+
+        cases = {
+            "import": "import pdf2csv",
+            "no-op run": "import pdf2csv; pdf2csv.process_pdfs()",
+            "worker start": worker_start_code,
+        }
+        over_budget = False
+        print(f"{'case':<14}{'median':>9}{'min':>9}{'budget':>9}")
+        for name, code in cases.items():
+            timings = [run_python(code, work_dir) for _ in range(args.repeat)]
+            median = statistics.median(timings)
+            over_budget |= median > budgets[name]
+            print(f"{name:<14}{median:>8.2f}s{min(timings):>8.2f}s{budgets[name]:>8.2f}s{'  OVER' if median > budgets[name] else ''}")
+        loop_ok = check_discovery_loop(work_dir)
+        print(f"folder link loop: {'skipped, no symlinks' if loop_ok is None else 'ok' if loop_ok else 'FAILED, the same PDF was found more than once'}")
+    sys.exit(1 if over_budget or loop_ok is False else 0)
+
+if __name__ == "__main__":
+    main()
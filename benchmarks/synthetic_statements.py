@@ -0,0 +1,255 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# A copy of the GNU General Public License can be found at
+# <https://www.gnu.org/licenses/>.
+
+# Writes synthetic RBC-style statements with the layouts pdf2csv.py expects, so the extractors can be
+# exercised and benchmarked without sharing real statements. No real account data is used.
+
+import os
+import random
+import argparse
+from datetime import date, timedelta
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+PAGE_WIDTH, PAGE_HEIGHT = letter
+
+merchants = ["TIM HORTONS #1234", "AMAZON.CA", "SHOPPERS DRUG MART", "PETRO-CANADA", "LOBLAWS 1045", "NETFLIX.COM", "CANADIAN TIRE #55", "SPOTIFY P1A2B3", "COSTCO WHOLESALE W532", "HYDRO ONE"]
+account_descriptions = ["Online Banking payment - 4567 HYDRO ONE", "e-Transfer sent J SMITH", "Payroll Deposit ACME CORP", "Interac purchase - 1234 LOBLAWS", "Monthly fee", "Contactless Interac purchase - 8989 TIM HORTONS", "ATM withdrawal - BRANCH 0042", "Mobile cheque deposit"]
+continuation_lines = ["REF 8839201", "CONF # 4F7A21", "BILL PAYMENT", "INV 2023-118"]
+
+def month_day(d, upper=False): # Formats a date the way RBC prints it on statements
+    text = d.strftime("%b %d")
+    return text.upper() if upper else d.strftime("%d %b")
+
+def money(value): # Formats an amount with thousands separators
+    return f"{value:,.2f}"
+
+def statement_period(rng, span_year_end): # Picks a statement start/end date, optionally straddling Dec/Jan
+    year = rng.randint(2018, 2023)
+    if span_year_end:
+        start = date(year, 12, rng.randint(3, 10))
+    else:
+        start = date(year, rng.randint(2, 10), rng.randint(3, 10))
+    return start, start + timedelta(days=30)
+
+def transaction_dates(rng, start, count): # Sorted transaction dates within the statement period
+    return sorted(start + timedelta(days=rng.randint(0, 29)) for _ in range(count))
+
+def write_account_statement(path, pages=2, transactions=40, multiline=0.25, seed=0, span_year_end=True): # Chequing/savings layout
+    rng = random.Random(seed)
+    start, end = statement_period(rng, span_year_end)
+    c = canvas.Canvas(path, pagesize=letter)
+    dates = transaction_dates(rng, start, transactions)
+    per_page = max(1, -(-transactions // pages))
+    balance = round(rng.uniform(500, 5000), 2)
+    col_x = {"date": 40, "desc": 85, "withdrawals": 390, "deposits": 470, "balance": 560}
+    index = 0
+    for page in range(1, pages + 1):
+        c.setFont("Helvetica", 9)
+        y = PAGE_HEIGHT - 50
+        if page == 1:
+            c.setFont("Helvetica-Bold", 12)
+            c.drawString(40, y, "Your RBC personal banking account statement")
+            c.setFont("Helvetica", 9)
+            y -= 16
+            c.drawString(40, y, f"From {start.strftime('%B')} {start.day}, {start.year} to {end.strftime('%B')} {end.day}, {end.year}")
+            y -= 14
+            c.drawString(40, y, f"Your account number: {rng.randint(10000, 99999)}-{rng.randint(1000000, 9999999)}")
+            y -= 30
+        else:
+            y -= 20
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(col_x["date"], y, "Date")
+        c.drawString(col_x["desc"], y, "Description")
+        c.drawRightString(col_x["withdrawals"], y, "Withdrawals ($)")
+        c.drawRightString(col_x["deposits"], y, "Deposits ($)")
+        c.drawRightString(col_x["balance"], y, "Balance ($)")
+        c.setFont("Helvetica", 9)
+        y -= 14
+        if page == 1:
+            c.drawString(col_x["date"], y, month_day(start))
+            c.drawString(col_x["desc"], y, "Opening Balance")
+            c.drawRightString(col_x["balance"], y, money(balance))
+            y -= 12
+        last_date = None
+        for _ in range(per_page):
+            if index >= transactions:
+                break
+            d = dates[index]
+            index += 1
+            description = rng.choice(account_descriptions)
+            amount = round(rng.uniform(3, 900), 2)
+            deposit = rng.random() < 0.3
+            balance = round(balance + amount if deposit else balance - amount, 2)
+            shown_date = month_day(d) if d != last_date else ""
+            last_date = d
+            if rng.random() < multiline:
+                c.drawString(col_x["date"], y, shown_date)
+                c.drawString(col_x["desc"], y, description)
+                y -= 12
+                shown_date = ""
+                description = rng.choice(continuation_lines)
+            c.drawString(col_x["date"], y, shown_date)
+            c.drawString(col_x["desc"], y, description)
+            c.drawRightString(col_x["deposits" if deposit else "withdrawals"], y, money(amount))
+            c.drawRightString(col_x["balance"], y, money(balance))
+            y -= 12
+        if index >= transactions:
+            c.drawString(col_x["date"], y, month_day(end))
+            c.drawString(col_x["desc"], y, "Closing Balance")
+            c.drawRightString(col_x["balance"], y, money(balance))
+        c.drawString(PAGE_WIDTH - 80, 30, f"{page} of {pages}")
+        c.showPage()
+    c.save()
+
+def write_credit_statement(path, pages=2, transactions=40, multiline=0.2, seed=0, span_year_end=True, brand="Visa"): # Visa/Mastercard layout
+    rng = random.Random(seed)
+    start, end = statement_period(rng, span_year_end)
+    c = canvas.Canvas(path, pagesize=letter)
+    dates = transaction_dates(rng, start, transactions)
+    per_page = max(1, -(-transactions // pages))
+    card = f"{rng.randint(4500, 4599)} {rng.randint(10, 99)}** **** {rng.randint(1000, 9999)}"
+    col_x = {"tdate": 52, "pdate": 98, "desc": 128, "amount": 356}
+    index = 0
+    for page in range(1, pages + 1):
+        y = PAGE_HEIGHT - 50
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(40, y, f"RBC Avion {brand} Infinite")
+        c.setFont("Helvetica", 9)
+        y -= 16
+        c.drawString(40, y, card)
+        y -= 14
+        c.drawString(40, y, f"STATEMENT FROM {start.strftime('%b').upper()} {start.day:02d}, {start.year} TO {end.strftime('%b').upper()} {end.day:02d}, {end.year}")
+        y = 585 if page == 1 else 598
+        c.setFont("Helvetica-Bold", 6)
+        c.drawString(col_x["tdate"], y + 6, "TRANSACTION")
+        c.drawString(col_x["tdate"], y, "DATE")
+        c.drawString(col_x["pdate"], y + 6, "POSTING")
+        c.drawString(col_x["pdate"], y, "DATE")
+        c.drawString(col_x["desc"], y, "ACTIVITY DESCRIPTION")
+        c.drawRightString(col_x["amount"], y, "AMOUNT ($)")
+        c.setFont("Helvetica", 7)
+        y -= 12
+        for _ in range(per_page):
+            if index >= transactions:
+                break
+            d = dates[index]
+            index += 1
+            merchant = rng.choice(merchants)
+            amount = round(rng.uniform(3, 400), 2)
+            if rng.random() < 0.1:
+                merchant = "PAYMENT - THANK YOU / PAIEMENT - MERCI"
+                amount = -amount
+            c.drawString(col_x["tdate"], y, month_day(d, upper=True))
+            c.drawString(col_x["pdate"], y, month_day(d + timedelta(days=1), upper=True))
+            c.drawString(col_x["desc"], y, merchant)
+            c.drawRightString(col_x["amount"], y, ("-$" if amount < 0 else "$") + money(abs(amount)))
+            y -= 10
+            if rng.random() < multiline:
+                c.drawString(col_x["desc"], y, "".join(str(rng.randint(0, 9)) for _ in range(23)))
+                y -= 10
+                c.drawString(col_x["desc"], y, f"Foreign Currency - USD {money(amount * 0.74)} Exchange rate - 1.3514")
+                y -= 10
+        if index >= transactions:
+            c.drawString(col_x["desc"], y, "NEW BALANCE")
+            c.drawRightString(col_x["amount"], y, "$1,234.56")
+        c.drawString(PAGE_WIDTH - 80, 30, f"{page} of {pages}")
+        c.showPage()
+    c.save()
+
+def write_credit_line_statement(path, pages=1, transactions=20, multiline=0.2, seed=0, span_year_end=False): # Royal Credit Line layout
+    rng = random.Random(seed)
+    start, end = statement_period(rng, span_year_end)
+    c = canvas.Canvas(path, pagesize=letter)
+    dates = transaction_dates(rng, start, transactions)
+    per_page = max(1, -(-transactions // pages))
+    col_left = [47, 86, 260, 377, 459, 522]
+    col_right = [82, 256, 373, 455, 518, 596]
+    balance = round(rng.uniform(1000, 20000), 2)
+    index = 0
+    for page in range(1, pages + 1):
+        y = PAGE_HEIGHT - 50
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(40, y, "Your Royal Credit Line")
+        c.setFont("Helvetica", 9)
+        y -= 16
+        c.drawString(40, y, f"Your loan account number: {rng.randint(10000000, 99999999)}-{rng.randint(1, 999):03d}")
+        y -= 14
+        c.drawString(40, y, f"From {start.strftime('%B')} {start.day}, {start.year} to {end.strftime('%B')} {end.day}, {end.year}")
+        y -= 40
+        c.setFont("Helvetica-Bold", 7)
+        c.drawString(col_left[0], y, "Date")
+        c.drawString(col_left[1], y, "Description")
+        c.drawRightString(col_right[2], y, "Interest/Fees/Insurance($)")
+        c.drawRightString(col_right[3], y, "Withdrawals($)")
+        c.drawRightString(col_right[4], y, "Payments($)")
+        c.drawRightString(col_right[5], y, "Balanceowing($)")
+        c.setFont("Helvetica", 7)
+        y -= 14
+        for _ in range(per_page):
+            if index >= transactions:
+                break
+            d = dates[index]
+            index += 1
+            amount = round(rng.uniform(20, 900), 2)
+            kind = rng.random()
+            c.drawString(col_left[0], y, d.strftime("%d%b"))
+            if kind < 0.15:
+                c.drawString(col_left[1], y, "INTEREST")
+                c.drawRightString(col_right[2], y, money(amount))
+                balance += amount
+            elif kind < 0.6:
+                c.drawString(col_left[1], y, "WITHDRAWAL")
+                c.drawRightString(col_right[3], y, money(amount))
+                balance += amount
+            else:
+                c.drawString(col_left[1], y, "PAYMENT")
+                c.drawRightString(col_right[4], y, money(amount))
+                balance -= amount
+            c.drawRightString(col_right[5], y, money(balance))
+            y -= 12
+            if rng.random() < multiline:
+                c.drawString(col_left[1], y, rng.choice(continuation_lines))
+                y -= 12
+        c.drawString(col_right[5] - 20, 30, f"{page}of{pages}")
+        c.showPage()
+    c.save()
+
+writers = {
+    "account": write_account_statement,
+    "credit": write_credit_statement,
+    "credit_line": write_credit_line_statement,
+}
+
+def write_corpus(output_dir, count=10, pages=2, transactions=40, multiline=0.25, seed=0, kinds=("account", "credit", "credit_line")): # Writes a mixed corpus of synthetic statements and returns their paths
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        path = os.path.join(output_dir, f"synthetic_{kind}_{i:04d}.pdf")
+        writers[kind](path, pages=pages, transactions=transactions, multiline=multiline, seed=seed + i, span_year_end=(i % 2 == 0))
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic RBC-style PDF statements")
+    parser.add_argument("output_dir")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--transactions", type=int, default=40)
+    parser.add_argument("--multiline", type=float, default=0.25, help="Fraction of transactions with a continuation line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kinds", default="account,credit,credit_line", help="Comma separated statement types to generate")
+    args = parser.parse_args()
+    paths = write_corpus(args.output_dir, args.count, args.pages, args.transactions, args.multiline, args.seed, tuple(args.kinds.split(",")))
+    print(f"Wrote {len(paths)} statements to {args.output_dir}")
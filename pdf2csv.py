@@ -12,209 +12,702 @@
 # <https://www.gnu.org/licenses/>.
 
 import os
+import sys
 import pandas as pd
 import numpy as np #Import numpy to handle NaN values
-import camelot
 import re
-import PyPDF2
-import pypdf
-import pdfplumber
 import warnings
-import matplotlib.pyplot as plt
-import traceback
 import logging
-import subprocess
+import hashlib
+import functools
+import contextlib
+import tracemalloc
+import queue
+import collections
+import pickle
+import gzip
+import json
+import time
+import inspect
+import fnmatch
+import io
+from importlib.metadata import version
+from urllib.parse import quote
 from tqdm import tqdm
-from mysecrets import PDF_DIR, CSV_FILE
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+try:
+    from mysecrets import PDF_DIR, CSV_FILE
+except ImportError: # Only the command line run reads its folders from mysecrets.py, iter_transactions() takes its files as arguments
+    PDF_DIR, CSV_FILE = None, None
 from datetime import datetime
 
 # Custom options for testing!
 save_file = 'on'
-print_all = 'off'
-print_extract = 'off'
-print_page = 'off'
-print_plot = 'off'
-print_logs = 'off'
-print_errors = 'on'
-print_trace = 'on'
-print_progress = 'on'
-
-
-if print_all == 'on':
-    print_extract = 'on'
-    print_page = 'on'
-    print_plot = 'on'
-    print_logs = 'on'
-    print_errors = 'on'
-    print_trace = 'on'
-    #print_progress = 'on'
-if print_errors == 'on':
-    warnings.filterwarnings("ignore") # Suppress PDFReadWarnings
+print_plot = 'off' # Shows camelot's text edge plot for each statement, needs matplotlib
+print_progress = 'on' # Shows a progress bar while files are converted
+log_level = 'WARNING' # Terminal output: 'DEBUG' adds the extracted text and tables, 'INFO' adds a line per file, 'WARNING' only shows problems and their tracebacks
+run_log = 'on' # Writes a run log next to the output with each file's status, timing, warnings and tracebacks, one JSON object per line
+run_log_level = 'INFO' # Lowest level of message kept in the run log
+profile_run = 'off' # Records wall and CPU time per stage for every file, plus page and camelot retry counts, in a JSON report next to the output, and logs the slowest files at the end of the run (shown with log_level 'INFO', and in the run log)
+profile_top = 10 # Number of slowest files listed at the end of a profiled run
+profile_memory = 'off' # Adds tracemalloc peaks to each profiled stage, which slows the run down
+watch_mode = 'off' # Keeps running and converts new or changed PDFs under PDF_DIR as they arrive, appending their transactions to one persistent CSV. Uses the watchdog package (inotify on Linux) when it's installed, otherwise polls
+watch_settle_seconds = 2 # A PDF is only converted once its size and modified time have stopped changing for this long, so partly downloaded files wait until they're complete
+watch_poll_seconds = 5 # How often PDF_DIR is rescanned when watchdog isn't installed
+include_patterns = ['*.pdf'] # Glob patterns for the files to convert, matched case-insensitively against each path inside PDF_DIR, e.g. '2019/*.pdf'. '*' also matches across folders
+exclude_patterns = [] # Glob patterns for files or folders to leave out, e.g. ['*/old/*', '*draft*']
+modified_after = '' # 'YYYY-MM-DD' to only convert files last modified on or after that day, '' for no limit
+modified_before = '' # 'YYYY-MM-DD' to only convert files last modified before that day, '' for no limit
+min_file_kb = 0 # Files smaller than this are skipped, 0 for no limit
+max_file_mb = 0 # Files larger than this are skipped, 0 for no limit
+account_engine = 'camelot' # Table engine for chequing/savings statements: 'camelot' (stream mode) or 'pdfplumber' (word coordinates, much faster)
+workers = 0 # Number of worker processes used to convert PDFs in parallel. 0 uses every CPU core, 1 processes files one at a time
+prefetch_threads = 4 # Threads reading upcoming PDFs into memory while earlier ones are parsed, so the latency of a slow network share is hidden behind the parsing. 0 reads each file when its turn comes
+prefetch_files = 16 # Most PDFs held in memory ahead of the workers. Reading pauses once this many are waiting, which keeps memory bounded
+page_split = 12 # With parallel processing, statements longer than this many pages are read as ranges of this many pages by separate workers, then put back together in page order. 0 keeps each statement in one worker
+cache_results = 'on' # Reuse extracted dataframes for PDFs whose contents haven't changed since a previous run
+cache_dir = '' # Folder for cached results, defaults to a !pdf2csv_cache folder inside PDF_DIR
+cache_max_mb = 500 # Size cap for the cache, least recently used results are evicted past this
+layout_cache = 'on' # Remembers which camelot settings read each statement layout (statement type, page size and header word positions) and tries them first on the next statement with the same layout. Kept next to the cached results when cache_results is on
+cache_pages = 'on' # With cache_results on, also keeps each PDF's page text, words and table cell grids in a compressed sidecar, so when only the table building or cleanup code changes the transactions are rebuilt from it without parsing the PDFs again
+cache_version = 1 # Bump to discard every cached result, e.g. after a pdfplumber/camelot upgrade
+dedupe_files = 'on' # Skips PDFs whose contents match a file found earlier in the run, e.g. a statement downloaded twice, before any parsing
+dedupe_transactions = 'on' # Drops transactions already written from an earlier statement, e.g. when statements overlap. Identical transactions within one statement are all kept
+output_stream = 'off' # Clean and append each file's transactions to the output as soon as it's converted, so memory stays flat on large archives
+output_compression = '' # '' for a plain .csv, 'gzip' for .csv.gz or 'zstd' for .csv.zst (needs the zstandard package)
+output_parquet = 'off' # Also write a Parquet dataset partitioned by account and statement year, with real dates and amounts (needs pyarrow)
+
+# camelot, pdfplumber, matplotlib and pypdf are imported inside the functions that use them, so a run with nothing new to parse and every worker process start without them
+
+logger = logging.getLogger("pdf2csv")
+
+def configure_logging(): # Sets the logger to the lowest level any output wants. Called at the start of a run and in each worker process rather than at import time
+    levels = [logging.getLevelName(log_level)] + ([logging.getLevelName(run_log_level)] if run_log == 'on' else [])
+    logger.setLevel(min(levels))
+    logger.propagate = False
+    warnings.filterwarnings("ignore") # Suppress PDFReadWarnings, the ones raised while converting a file are recorded in the run log instead
+
+class JsonLogFormatter(logging.Formatter): # One JSON object per line, so the run log can be loaded with pandas.read_json(path, lines=True)
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "message": record.getMessage()}
+        entry.update(getattr(record, "details", {}))
+        if record.exc_info:
+            entry["traceback"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["traceback"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class LogRecordCollector(logging.Handler): # Holds the log records of one file, flattened so they can be pickled back from a worker process
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.getMessage(), None, None
+        self.records.append(record)
+
+def start_run_logging(error_log_path, run_log_path): # Adds the terminal, error log and run log handlers for one run and returns them so they can be removed afterwards
+    configure_logging()
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(log_level)
+    console.setFormatter(logging.Formatter('%(message)s'))
+    error_log = logging.FileHandler(error_log_path, mode='w') # Errors also go to a plain text log in the same directory as the PDF files
+    error_log.setLevel(logging.ERROR)
+    error_log.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    handlers = [console, error_log]
+    if run_log == 'on':
+        structured_log = logging.FileHandler(run_log_path, mode='w', encoding='utf-8', delay=True)
+        structured_log.setLevel(run_log_level)
+        structured_log.setFormatter(JsonLogFormatter())
+        handlers.append(structured_log)
+    for handler in handlers:
+        logger.addHandler(handler)
+    return handlers
+
+def stop_run_logging(handlers):
+    for handler in handlers:
+        logger.removeHandler(handler)
+        handler.close()
+
+active_profile = None # Stage timings being collected for the file being converted, or for the run itself between files. None when profiling is off
+memory_peaks = [] # Running tracemalloc peaks of the stages currently open, innermost last
+
+def new_profile():
+    return {"stages": {}, "counters": {}}
+
+@contextlib.contextmanager
+def profile_stage(stage): # Adds the block's wall time, CPU time and, when tracemalloc is on, its memory peak to the active profile. Stages can nest, an outer stage's time includes its inner ones
+    profile = active_profile
+    if profile is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        memory_peaks.append(0)
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        entry = profile["stages"].setdefault(stage, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+        entry["calls"] += 1
+        entry["wall"] += time.perf_counter() - wall
+        entry["cpu"] += time.process_time() - cpu
+        if tracing: # An inner stage resets the peak, so it hands its own peak up to the stage around it
+            peak = max(tracemalloc.get_traced_memory()[1], memory_peaks.pop())
+            if memory_peaks:
+                memory_peaks[-1] = max(memory_peaks[-1], peak)
+            entry["peak_mb"] = max(entry.get("peak_mb", 0), peak / 1024 / 1024)
+
+def profiled(stage=None): # Decorator form of profile_stage, named after the function unless a stage is given
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile_stage(stage or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_profile(counter, amount=1): # Adds to a counter in the active profile, such as pages or camelot retries
+    if active_profile is not None:
+        active_profile["counters"][counter] = active_profile["counters"].get(counter, 0) + amount
 
 headers = ["Date", "Description", "Withdrawals ($)", "Deposits ($)", "Balance ($)"] # Define headers to use from table
 cc_headers = ["DATE", "ACTIVITY DESCRIPTION", "AMOUNT ($)"] # Credit card headers
 cl_headers = ["Date", "Description", "Interest/Fees/Insurance ($)", "Withdrawals ($)", "Payments ($)", "Balance owing ($)"] # Credit line headers
 
-def get_pdf_files_recursive(PDF_DIR): # Function to get a list of PDF files in a directory and its subdirectories
-    pdf_files = []
-    for root, _, files in os.walk(PDF_DIR):
-        for file in files:
-            if file.lower().endswith('.pdf'):
-                pdf_files.append(os.path.join(root, file))
-    return pdf_files
+account_columns = ["Date", "Description", "Credit ($)", "Debit ($)", "Balance ($)"] # Columns the account engines hand to clean_account_table
+account_header_words = {"Date": "Date", "Description": "Description", "Withdrawals": "Credit ($)", "Deposits": "Debit ($)", "Balance": "Balance ($)"} # Header word to output column
+
+# Camelot settings tried in order on account statements until a table with at least min_columns is found
+account_pg1_ladder = [
+    {"edge_tol": 35, "column_tol": 2, "row_tol": 4, "min_columns": 5}, # Explicit parameters
+    {"edge_tol": 50, "min_columns": 5}, # When the right tables aren't found, adjust the parameters to try a better tolerance
+    {"edge_tol": 100, "min_columns": 4}, # When the 5 column table isn't found, adjust for a 4 column table
+]
+account_pg2p_ladder = [
+    {"edge_tol": 35, "column_tol": 2, "row_tol": 4, "min_columns": 5},
+    {"edge_tol": 22, "column_tol": 2, "row_tol": 4, "min_columns": 5}, # When the right tables aren't found, adjust the parameters to try a better tolerance
+    {"edge_tol": 9, "column_tol": 2, "row_tol": 4, "min_columns": 4},
+]
+credit_pg1_ladder = [
+    {"table_areas": ['50, 595, 360, 35'], "columns": ['96, 125, 306'], "edge_tol": 1, "column_tol": 0, "row_tol": 6, "split_text": True, "min_columns": 3}, # Explicit parameters
+]
+credit_pg2p_ladder = [
+    {"table_areas": ['50, 608, 360, 35'], "columns": ['96, 125, 306'], "edge_tol": 1, "column_tol": 0, "row_tol": 6, "split_text": True, "min_columns": 3}, # The table starts a little higher after page 1
+]
+credit_header_words = ["TRANSACTION", "POSTING", "ACTIVITY", "DESCRIPTION", "AMOUNT"] # Words of the Visa/Mastercard table header, used to fingerprint its layout
+
+def get_pdf_files_recursive(PDF_DIR, check_header=True): # Yields the PDF files in a directory and its subdirectories as they're found, in os.walk order, so conversion can start before a large tree has been walked. Applies the discovery patterns and filters and, with check_header, skips files that don't start like a PDF
+    directories = [PDF_DIR]
+    while directories:
+        directory = directories.pop()
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative_path = os.path.relpath(entry.path, PDF_DIR)
+                    try:
+                        if entry.is_dir(follow_symlinks=False): # Linked folders aren't entered, like os.walk, so a link back up the tree can't loop
+                            if not matches_discovery_patterns(relative_path + os.sep, exclude_patterns):
+                                subdirectories.append(entry.path)
+                        elif entry.is_file() and matches_discovery_filters(relative_path, entry.stat()):
+                            if not check_header or has_pdf_header(entry.path):
+                                yield entry.path
+                    except OSError as e: # Removed or unreadable since the listing
+                        logger.warning("Couldn't read %s | %s", entry.path, e)
+        except OSError as e:
+            logger.warning("Couldn't list %s | %s", directory, e)
+        directories.extend(reversed(subdirectories)) # Depth first, so each folder is finished before the next one at its level
+
+def matches_discovery_patterns(relative_path, patterns): # Case-insensitive glob match with / as the separator on every platform
+    relative_path = relative_path.replace(os.sep, '/').lower()
+    return any(fnmatch.fnmatchcase(relative_path, pattern.lower()) for pattern in patterns)
+
+def matches_discovery_filters(relative_path, stat): # Whether a file passes include_patterns, exclude_patterns and the size and modified date limits
+    if not matches_discovery_patterns(relative_path, include_patterns) or matches_discovery_patterns(relative_path, exclude_patterns):
+        return False
+    if stat.st_size < min_file_kb * 1024 or (max_file_mb and stat.st_size > max_file_mb * 1024 * 1024):
+        return False
+    if modified_after and stat.st_mtime < datetime.strptime(modified_after, "%Y-%m-%d").timestamp():
+        return False
+    if modified_before and stat.st_mtime >= datetime.strptime(modified_before, "%Y-%m-%d").timestamp():
+        return False
+    return True
+
+def has_pdf_header(pdf_path, pdf_data=None): # Checks for the %PDF- marker near the start of the file, or of its contents when they've already been read, so empty and mislabelled files are skipped before pdfplumber sees them
+    if pdf_data is None:
+        with open(pdf_path, 'rb') as pdf_file:
+            pdf_data = pdf_file.read(1024)
+    if b"%PDF-" in pdf_data[:1024]: # Readers accept some junk ahead of the marker
+        return True
+    logger.warning("Skipped %s, it doesn't start with a %s header", pdf_path, "%PDF-")
+    return False
+
+camelot_layout_params = {"line_overlap": 0.5, "char_margin": 1.0, "line_margin": 0.5, "word_margin": 0.1, "boxes_flow": 0.5, "detect_vertical": True, "all_texts": True} # Camelot's default pdfminer layout parameters
+
+class StatementDocument: # Parses a PDF once and shares the page layout, characters and words between classification and every table extractor. Takes a path or a binary file object. Given a recording dict (see load_page_cache()), the page count, text, words, sizes, header lines and tables are served from it and what's missing is read and added, so the PDF is only opened once something isn't recorded
+    def __init__(self, pdf_path, recording=None):
+        self.pdf_path = pdf_path
+        self.recording = recording
+        self.recording_changed = False
+        self.pdf = None
+        self.text = {}
+        self.text_objects = {}
+        self.text_lines = {}
+        if recording is None or "page_count" not in recording:
+            self.open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        if self.pdf is None:
+            import pdfplumber
+            self.pdf = pdfplumber.open(self.pdf_path, laparams=camelot_layout_params) # Uses camelot's layout parameters so its stream parser can read the same parse
+            if self.recording is not None and "page_count" not in self.recording:
+                self.recording["page_count"] = len(self.pdf.pages)
+                self.recording_changed = True
+        return self.pdf
+
+    def close(self):
+        if self.pdf is not None:
+            self.pdf.close()
+
+    @property
+    def pages(self):
+        return self.open().pages
+
+    @property
+    def page_count(self):
+        return self.recording["page_count"] if self.pdf is None else len(self.pdf.pages)
+
+    def recorded(self, kind, key, read): # Returns the recorded value, reading and recording it on a miss. Without a recording it's just read
+        if self.recording is None:
+            return read()
+        entries = self.recording.setdefault(kind, {})
+        if key not in entries:
+            entries[key] = read()
+            self.recording_changed = True
+        return entries[key]
+
+    def page_numbers(self, pages): # Expands camelot style page strings such as '1', '2-end' or '1,3-4' into page numbers
+        page_numbers = []
+        for page_range in pages.split(','):
+            if not page_range:
+                continue
+            if '-' in page_range:
+                start, end = page_range.split('-')
+                end = self.page_count if end == 'end' else int(end)
+                page_numbers.extend(range(int(start), end + 1))
+            else:
+                page_numbers.append(self.page_count if page_range == 'end' else int(page_range))
+        return [page_number for page_number in page_numbers if 1 <= page_number <= self.page_count]
+
+    def page_text(self, page_number): # Layout text of a page, extracted once
+        if page_number not in self.text:
+            self.text[page_number] = self.recorded("text", page_number, lambda: self.pages[page_number - 1].extract_text(x_tolerance=1, y_tolerance=4, layout=True))
+        return self.text[page_number]
+
+    def page_chars(self, page_number):
+        return self.pages[page_number - 1].chars
+
+    def page_words(self, page_number, **kwargs):
+        return self.recorded("words", (page_number, repr(sorted(kwargs.items()))), lambda: self.pages[page_number - 1].extract_words(**kwargs))
+
+    def page_size(self, page_number):
+        return self.recorded("sizes", page_number, lambda: (self.pages[page_number - 1].width, self.pages[page_number - 1].height))
+
+    def page_table(self, page_number, table_settings): # pdfplumber's cell grid for the page's table
+        return self.recorded("page_tables", (page_number, repr(table_settings)), lambda: self.pages[page_number - 1].extract_table(table_settings))
+
+    def page_layout(self, page_number): # The pdfminer LTPage that camelot would otherwise re-parse from a single page copy of the PDF
+        return self.pages[page_number - 1].layout
+
+    def page_text_objects(self, page_number): # Camelot's image, horizontal and vertical text objects for a page, collected once for every tolerance retry
+        if page_number not in self.text_objects:
+            from camelot.utils import get_text_objects
+            layout = self.page_layout(page_number)
+            self.text_objects[page_number] = (get_text_objects(layout, ltype="image"), get_text_objects(layout, ltype="horizontal_text"), get_text_objects(layout, ltype="vertical_text"))
+        return self.text_objects[page_number]
+
+    def page_text_lines(self, page_number): # Reading order text lines with their left/right/middle x and bottom y, the tolerance independent half of camelot's text edge detection
+        if page_number not in self.text_lines:
+            text_lines = sorted(self.page_text_objects(page_number)[1], key=lambda x: (-x.y0, x.x0))
+            self.text_lines[page_number] = [(line, {"left": line.x0, "right": line.x1, "middle": line.x0 + (line.x1 - line.x0) / 2.0}, line.y0) for line in text_lines if len(line.get_text().strip()) > 1]
+        return self.text_lines[page_number]
+
+    def page_header_line(self, page_number, header_words): # The text lines starting with a header word on the row with the most of them, as (text, x, bottom) rounded to whole points. Read from camelot's text lines, which the table reading needs anyway, rather than from words that would parse every character of the page
+        def read():
+            rows = {}
+            for line, __, bottom in self.page_text_lines(page_number):
+                text = line.get_text().strip()
+                if any(text.startswith(header_word) for header_word in header_words):
+                    rows.setdefault(round(bottom), []).append((text, round(line.x0), round(bottom)))
+            return max(rows.values(), key=len, default=[])
+        return self.recorded("header_lines", (page_number, repr(header_words)), read)
+
+@functools.lru_cache(maxsize=None)
+def document_stream_class(): # Defines DocumentStream on first use, since subclassing camelot's parser means importing camelot
+    from camelot.core import TextEdges
+    from camelot.parsers import Stream
+
+    class DocumentStream(Stream): # Camelot's stream parser reading a StatementDocument page instead of re-parsing the PDF from disk
+        def __init__(self, document, **kwargs):
+            super().__init__(**kwargs)
+            self.document = document
+            self.page_number = 1
+
+        def _generate_layout(self, filename, layout_kwargs):
+            self.filename = filename
+            self.layout_kwargs = layout_kwargs
+            self.layout = self.document.page_layout(self.page_number)
+            self.dimensions = (self.layout.bbox[2], self.layout.bbox[3])
+            images, horizontal_text, vertical_text = self.document.page_text_objects(self.page_number)
+            self.images = list(images) # Copies, since camelot sorts these lists in place
+            self.horizontal_text = list(horizontal_text)
+            self.vertical_text = list(vertical_text)
+            self.pdf_width, self.pdf_height = self.dimensions
+            self.rootname, __ = os.path.splitext(self.filename)
+            self.imagename = "".join([self.rootname, ".png"])
+
+        def _nurminen_table_detection(self, textlines): # Same as camelot's, but builds the text edges from the document's precomputed text lines
+            textlines.sort(key=lambda x: (-x.y0, x.x0))
+            if self.table_regions is None:
+                textedges = generate_text_edges(self.document.page_text_lines(self.page_number), self.edge_tol)
+            else:
+                textedges = TextEdges(edge_tol=self.edge_tol)
+                textedges.generate(textlines)
+            relevant_textedges = textedges.get_relevant()
+            self.textedges.extend(relevant_textedges)
+            table_bbox = textedges.get_table_areas(textlines, relevant_textedges)
+            if not len(table_bbox): # Treat the whole page as the table area if no table areas are found
+                table_bbox = {(0, 0, self.pdf_width, self.pdf_height): None}
+            return table_bbox
+
+    return DocumentStream
+
+def generate_text_edges(text_lines, edge_tol): # Camelot's TextEdges.generate() with plain float comparisons in place of a numpy isclose call per edge
+    from camelot.core import TextEdges, TextEdge, TEXTEDGE_REQUIRED_ELEMENTS
+    textedges = TextEdges(edge_tol=edge_tol)
+    for line, x_coords, y0 in text_lines:
+        for align in ["left", "right", "middle"]:
+            x = x_coords[align]
+            edges = textedges._textedges[align]
+            for edge in edges:
+                if abs(edge.x - x) <= 0.5 + 1e-05 * abs(x): # np.isclose(edge.x, x, atol=0.5)
+                    if abs(edge.y0 - y0) <= edge_tol + 1e-05 * abs(y0): # np.isclose(edge.y0, y0, atol=edge_tol)
+                        edge.x = (edge.intersections * edge.x + x) / float(edge.intersections + 1)
+                        edge.y0 = y0
+                        edge.intersections += 1
+                        if edge.intersections > TEXTEDGE_REQUIRED_ELEMENTS:
+                            edge.is_valid = True
+                    break
+            else:
+                edges.append(TextEdge(x, y0, line.y1, align=align))
+    return textedges
+
+def read_tables_with_ladder(document, pages, ladder, layout_name=None, header_words=()): # Walks the ladder for each page of the range on its own, so a page gets the same tables whether a serial run reads it with the rest of the statement or a worker reads it in a split page range
+    if not pages:
+        return []
+    cleaned = []
+    for page_number in document.page_numbers(pages):
+        cleaned.extend(read_page_with_ladder(document, page_number, ladder, layout_name, header_words))
+    return cleaned
+
+def read_page_with_ladder(document, page_number, ladder, layout_name=None, header_words=()): # Tries each camelot setting in the ladder on the same parsed page until one finds tables with enough columns. With layout_cache on and a layout_name, the setting that last read the same layout is tried first and a new winner is remembered
+    fingerprint = known = None
+    if layout_cache == 'on' and layout_name:
+        fingerprint = layout_fingerprint(document, page_number, layout_name, header_words)
+        layouts = load_known_layouts()
+        if fingerprint not in layouts and layout_cache_path(): # Another worker may have learned it since the file was loaded
+            layouts.update(read_layouts_file(layout_cache_path()))
+        known = layouts.get(fingerprint)
+        if known is not None:
+            count_profile("layout_hits")
+            ladder = [known] + [settings for settings in ladder if settings != known]
+    cleaned = []
+    for attempt, settings in enumerate(ladder):
+        if attempt:
+            count_profile("camelot_retries")
+        read_settings = dict(settings)
+        min_columns = read_settings.pop("min_columns")
+        tables = read_tables(document, pages=str(page_number), suppress_stdout=True, **read_settings)
+        cleaned = [table for table in tables if table.shape[1] >= min_columns]
+        if cleaned:
+            if fingerprint and settings != known:
+                remember_layout(fingerprint, settings)
+            break
+    return cleaned
+
+def layout_fingerprint(document, page_number, layout_name, header_words): # Identifies a statement layout from a page: the ladder reading it, the page size and the positions of its header words
+    width, height = document.page_size(page_number)
+    return hashlib.sha256(repr((layout_name, round(width), round(height), document.page_header_line(page_number, header_words))).encode()).hexdigest()[:16]
+
+@functools.lru_cache(maxsize=None)
+def layout_cache_path(): # layouts.json inside the results cache folder for the current extractors, so remembered settings are dropped with the results when the code changes. None when the layouts are only kept for this process
+    if cache_results != 'on' or PDF_DIR is None:
+        return None
+    return os.path.join(cache_dir or os.path.join(PDF_DIR, '!pdf2csv_cache'), get_cache_fingerprint(), 'layouts.json')
+
+known_layouts = None # Layout fingerprint -> the camelot settings that last read it, loaded on first use
+
+def read_layouts_file(path):
+    try:
+        with open(path) as layouts_file:
+            return json.load(layouts_file)
+    except (OSError, ValueError):
+        return {}
+
+def load_known_layouts():
+    global known_layouts
+    if known_layouts is None:
+        path = layout_cache_path()
+        known_layouts = read_layouts_file(path) if path else {}
+    return known_layouts
+
+def remember_layout(fingerprint, settings): # Records the winning settings for a layout. Other worker processes may have written the file since it was loaded, so their entries are merged in before it's replaced
+    layouts = load_known_layouts()
+    path = layout_cache_path()
+    if path:
+        layouts.update(read_layouts_file(path))
+    layouts[fingerprint] = settings
+    if path:
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w') as layouts_file:
+                json.dump(layouts, layouts_file, indent=0)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("Couldn't save the layout cache %s | %s", path, e)
+
+@profiled("camelot")
+def read_tables(document, pages='1', suppress_stdout=False, **kwargs): # Stands in for camelot.read_pdf(flavor='stream') using the document's existing parse. When the document keeps a recording, each page's tables are recorded under the page number and settings, so any page range (a serial '2-end' or a worker's '2' and '3,4') is assembled from the same entries, and come back as RecordedTables of their cell grids, whether they were just read or recorded on an earlier run
+    def read(page_number):
+        parser = document_stream_class()(document, **kwargs)
+        parser.page_number = page_number
+        return sorted(parser.extract_tables(f"page-{page_number}.pdf", suppress_stdout=suppress_stdout)) # Camelot reads the page number back from this name
+    page_numbers = sorted(set(document.page_numbers(pages)))
+    if document.recording is None or print_plot == 'on': # Plotting needs camelot's own tables, so they're read rather than recorded
+        from camelot.core import TableList
+        return TableList([table for page_number in page_numbers for table in read(page_number)])
+    settings = repr(sorted(kwargs.items()))
+    recorded_tables = []
+    for page_number in page_numbers:
+        recorded_tables.extend(document.recorded("camelot", (page_number, settings), lambda: [(table.page, table.df.values.tolist(), table.parsing_report) for table in read(page_number)]))
+    return [RecordedTable(page, cells, parsing_report) for page, cells, parsing_report in recorded_tables]
+
+class RecordedTable: # The parts of a camelot Table the extractors use, rebuilt from its recorded cell grid
+    def __init__(self, page, cells, parsing_report):
+        self.page = page
+        self.df = pd.DataFrame(cells)
+        self.parsing_report = parsing_report
+
+    @property
+    def shape(self):
+        return self.df.shape
+
+def first_page_split(document, pages=None): # Splits a page range into camelot page strings for page 1, which has its own table settings, and the pages after it. Either is '' when the range doesn't include it
+    page_numbers = document.page_numbers(pages or '1-end')
+    first = '1' if 1 in page_numbers else ''
+    rest = ",".join(str(page_number) for page_number in page_numbers if page_number != 1)
+    return first, rest
+
+def join_page_tables(tables): # Concatenates a statement's page tables in page order before its transactions are assembled. The repeated header row at the top of each later page is dropped, so a transaction that continues across a page break isn't cut off by it
+    joined = [tables[0]]
+    for table in tables[1:]:
+        if len(table) and header_filter_pattern.search(" ".join(table.iloc[0].astype(str))):
+            table = table.iloc[1:]
+        joined.append(table)
+    return pd.concat(joined, ignore_index=True)
 
 def pypdf_extract_from_pdf(pdf_path): # Uses PyPDF2 to extract initial information from account statements (account #, year)
-    statement_type = "unknown"
     with open(pdf_path, 'rb') as pdf_file:
-        # pdf_reader = PyPDF2.PdfFileReader(pdf_file)
+        import pypdf
         pdf_reader = pypdf.PdfReader(pdf_file)
-        pypdf2_full_extract = ""
-        statement_type = ""
-        for page_number in range(pdf_reader.numPages):
-            page = pdf_reader.getPage(page_number)
-            pypdf2_full_extract += page.extract_text()
-
-        if print_extract == 'on':
-            print("------------------PyPDF2-----------------")
-            print(pypdf2_full_extract)
-            print("----------------PyPDF2 End---------------")
-
-        # Search for the pattern "Your RBC personal <anything> account statement"
-        match = re.search(r"Your\s+RBC\s+personal\s+.*?\s*account\s+statement", pypdf2_full_extract, re.IGNORECASE)
-        if match:
-            statement_type = "account"
-            if print_logs == 'on':
-                print("\nFound " + statement_type + " match")
-            # Find the account number after "Your account number:"
-            account_number = re.search(r'Your account number:\s*(\d{5}-\d{7})', pypdf2_full_extract)
-            account_number = account_number.group(1) if account_number else None
-        if not match:
-            match = re.search(r".*RBC.*(?:Visa|Mastercard).*", pypdf2_full_extract, re.IGNORECASE)
-            if match:
-                statement_type = "credit"
-                if print_logs == 'on':
-                    print("\nFound " + statement_type + " match")
-                # Find the credit card number
-                account_number = re.search(r'(?:\b\d{4}\s\d{2}\*\*\s\*\*\*\*\s\d{4}\b)', pypdf2_full_extract, re.IGNORECASE)
-                account_number = account_number.group(0) if account_number else None
-                print(account_number)
-        if not match:
-            match = re.search(r"Your\s+Royal\s+Credit\s+Line", pypdf2_full_extract, re.IGNORECASE)
-            if match:
-                statement_type = "credit_line"
-                if print_logs == 'on':
-                    print("\nFound " + statement_type + " match")
-                # Find the credit card number
-                #account_number = re.search(r'(^\d{8}-\d{3}$)', pypdf2_full_extract, re.IGNORECASE) # Searches based on just the account number
-                account_number = re.search(r'(Your loan account number:\s*\d{8}-\d{3})', pypdf2_full_extract, re.IGNORECASE) # Searches based on the statement + account number
-                account_number = account_number.group(0) if account_number else None
-            if not match:
-                return None
-
-        if print_all == 'logs':
-            print("Account number: " + account_number)
-
-        # Find the string right below the matched pattern
-        year_pattern = r", (20\d{2})"
-        year_matches = re.findall(year_pattern, pypdf2_full_extract[match.end():])
-        year2 = ""
-        if not year_matches:
-            year = "2000"
-        else:
-            if len(year_matches) >= 2 and year_matches[0] != year_matches[1]:
-                year = year_matches[0]
-                year2 = year_matches[1]
-            else:
-                year = year_matches[0]
-                year2 = year
-        
-        if print_logs == 'on':
-            print("Account: " + str(account_number))
-            print("Year: " + year)
-            print("Year2: " + year2)
+        pypdf2_full_extract = "".join(page.extract_text() for page in pdf_reader.pages)
+
+    logger.debug("PyPDF2 extract:\n%s", pypdf2_full_extract)
+
+    statement_type, account_number, year_matches = classify_statement_text(pypdf2_full_extract)
+    if statement_type == "unknown":
+        return None
+    logger.info("Found %s match", statement_type)
+    year, year2 = pick_statement_years(year_matches)
+    logger.info("Account: %s, Year: %s, Year2: %s", account_number, year, year2)
 
     return year, year2, account_number, statement_type
 
-def pdfplumber_extract_from_pdf(pdf_path):  # Updated to use pdfplumber
-    statement_type = "unknown"
+def classify_statement_text(pdf_extract): # Finds the statement type with one scan for every detector's anchor at once, then reads that type's account number and statement years
+    best = None
+    for match in statement_anchor_pattern.finditer(pdf_extract):
+        rank = statement_detector_ranks[match.lastgroup]
+        if best is None or rank < best:
+            best = rank
+        if best == 0: # Nothing outranks the first detector, so the rest of the text isn't scanned
+            break
+    if best is None:
+        return "unknown", None, []
+
+    detector = statement_detectors[best]
+    account_number = detector["account_number"].search(pdf_extract)
+    account_number = account_number.group(1) if account_number else None
+
+    return detector["type"], account_number, detector["years"].findall(pdf_extract)
+
+def pick_statement_years(year_matches): # The statement period's first and second year, which differ for statements that span New Year
+    if not year_matches:
+        return "2000", ""
+    if len(year_matches) >= 2 and year_matches[0] != year_matches[1]:
+        return year_matches[0], year_matches[1]
+    return year_matches[0], year_matches[0]
+
+@profiled("classify")
+def pdfplumber_extract_from_pdf(document):  # Updated to use pdfplumber. Reads page text lazily and stops once the type, account number and a year are known, which is usually page 1
     pdf_extract = ""
+    statement_type, account_number, year_matches = "unknown", None, []
     
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text(x_tolerance=1, y_tolerance=4, layout=True)
-            if text:
-                pdf_extract += text + "\n"
-
-    if print_extract == 'on':
-        print("------------------pdfplumber-----------------")
-        print(pdf_extract)
-        print("----------------pdfplumber End---------------")
-
-    # Search for the pattern "Your RBC personal <anything> account statement"
-    match = re.search(r"Your\s+RBC\s+personal\s+.*?\s*account\s+statement", pdf_extract, re.IGNORECASE)
-    if match:
-        statement_type = "account"
-        if print_logs == 'on':
-            print("\nFound " + statement_type + " match")
-        # Find the account number after "Your account number:"
-        account_number = re.search(r'Your account number:\s*(\d{5}-\d{7})', pdf_extract)
-        account_number = account_number.group(1) if account_number else None
-    
-    if not match:
-        match = re.search(r".*RBC.*(?:Visa|Mastercard).*", pdf_extract, re.IGNORECASE)
-        if match:
-            statement_type = "credit"
-            if print_logs == 'on':
-                print("\nFound " + statement_type + " match")
-            # Find the credit card number
-            account_number = re.search(r'(?:\b\d{4}\s\d{2}\*\*\s\*\*\*\*\s\d{4}\b)', pdf_extract, re.IGNORECASE)
-            account_number = account_number.group(0) if account_number else None
-    
-    if not match:
-        #match = re.search(r"Your\s+Royal\s+Credit\s+Line", pdf_extract, re.IGNORECASE)
-        match = re.search(r"Your Royal Credit Line", pdf_extract, re.IGNORECASE)
-        if match:
-            statement_type = "credit_line"
-            if print_logs == 'on':
-                print("\nFound " + statement_type + " match")
-            # Find the loan account number
-            account_number = re.search(r'Your loan account number:\s*(\d{8}-\d{3})', pdf_extract, re.IGNORECASE)
-            account_number = account_number.group(1) if account_number else None
-    if not match:
-        statement_type = "unknown"
+    for page_number in range(1, document.page_count + 1):
+        text = document.page_text(page_number)
+        count_profile("pages_classified")
+        if text:
+            pdf_extract += text + "\n"
+        if logger.isEnabledFor(logging.DEBUG): # The full text is only needed for debug logging
+            continue
+        statement_type, account_number, year_matches = classify_statement_text(pdf_extract)
+        if statement_type != "unknown" and account_number is not None and year_matches: # A statement period within one year only names it once, so later pages are read only while no year has been found
+            break
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("pdfplumber extract:\n%s", pdf_extract)
+        statement_type, account_number, year_matches = classify_statement_text(pdf_extract)
+
+    if statement_type != "unknown":
+        logger.info("Found %s match", statement_type)
+
+    if statement_type == "unknown":
         year = "none"
         year2 = "none"
         account_number = "none"
         return year, year2, account_number, statement_type, pdf_extract
     
-    if print_all == 'logs':
-        print("Account number: " + str(account_number))
+    logger.debug("Account number: %s", account_number)
 
-    # Extract the year from the text after the matched pattern
-    year_pattern = r", (20\d{2})"
-    year_matches = re.findall(year_pattern, pdf_extract)
-    year2 = ""
-    if not year_matches:
-        year = "2000"
-    else:
-        if len(year_matches) >= 2 and year_matches[0] != year_matches[1]:
-            year = year_matches[0]
-            year2 = year_matches[1]
-        else:
-            year = year_matches[0]
-            year2 = year
+    year, year2 = pick_statement_years(year_matches)
     
-    if print_logs == 'on':
-        print("Account: " + str(account_number))
-        print("Year: " + year)
-        print("Year2: " + year2)
-        print("Year Matches:" + str(year_matches))
-        print("-----------")
+    logger.info("Account: %s, Year: %s, Year2: %s, Year matches: %s", account_number, year, year2, year_matches)
 
     #return year, year2, account_number, statement_type, pypdf2_full_extract
     return year, year2, account_number, statement_type, pdf_extract
 
-def extract_account_tables_with_camelot(pdf_path, year, year2, account_number): # Function to extract tables from the PDF using Camelot in stream mode and perform initial processing
+continuation_rules = [ # Credit statement lines that belong to the transaction line above them: the line's description must match 'line', and the line above must match 'after' when given
+    {"name": "foreign currency", "line": r"^Foreign Currency", "after": r"\b\d{23}\b"}, # Foreign currency details follow the reference number line
+    {"name": "reference number", "line": r"\b\d{23}\b"}, # 23 digit reference numbers under a purchase
+    {"name": "cash back", "line": r"\d{10}", "after": r"^CASH BACK"},
+    {"name": "offer", "line": r".*\d{10,}", "after": r"^OFFER RONA"},
+]
+
+def match_continuation_rules(descriptions, rules): # Flags each line that one of the declarative continuation rules attaches to the line above it
+    descriptions = descriptions.fillna("").astype(str)
+    previous = descriptions.shift(1, fill_value="")
+    attached = pd.Series(False, index=descriptions.index)
+    for rule in rules:
+        matches = descriptions.str.contains(rule["line"], regex=True)
+        if "after" in rule:
+            matches &= previous.str.contains(rule["after"], regex=True)
+        attached |= matches
+    return attached
+
+@profiled("merge")
+def merge_transaction_lines(df, groups, heads, members, date_col="Date", desc_col="Description"): # Shared transaction assembler: joins the descriptions (" | ") and dates of each member group into its head row in one groupby pass, then blanks the group's other rows
+    df = df.copy()
+    desc = df[desc_col].fillna("").astype(str).str.strip()
+    date = df[date_col].fillna("").astype(str).str.strip()
+    lines = members & (desc != "") # Only lines with a description contribute their description and date
+    merged_desc = desc[lines].groupby(groups[lines], sort=False).agg(" | ".join)
+    dated = lines & (date != "")
+    merged_date = date[dated].groupby(groups[dated], sort=False).agg(" ".join)
+
+    head_groups = groups[heads]
+    df.loc[heads, desc_col] = head_groups.map(merged_desc).fillna("").values
+    df.loc[heads, date_col] = head_groups.map(merged_date).fillna("").values
+    merged_away = members & ~heads
+    df.loc[merged_away, [date_col, desc_col]] = ""
+    if "Account #" in df.columns:
+        df.loc[merged_away, "Account #"] = ""
+    return df
+
+month_numbers = {month: number for number, month in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+statement_date_pattern = r"^\s*(?:(?P<day>\d{1,2})\s*(?P<month>[A-Za-z]{3})|(?P<month_first>[A-Za-z]{3})\s*(?P<day_last>\d{1,2}))" # "05 Oct" and "22Nov" on account and credit line statements, "DEC 30" on credit cards. Merged lines keep their first date
+
+def normalize_statement_dates(dates, year, year2): # Turns a column of statement dates without a year into datetime64 in one vectorized pass, anything else becomes NaT. When the statement period runs into a second year, January to June belong to the later year
+    parts = dates.astype("string").str.extract(statement_date_pattern)
+    day = parts["day"].fillna(parts["day_last"]).astype("float")
+    month = parts["month"].fillna(parts["month_first"]).str.lower().map(month_numbers).astype("float")
+    year = int(year)
+    year2 = int(year2) if year2 else year
+    years = np.where(month < 7, year2, year) if year2 != year else year
+    return pd.to_datetime(pd.DataFrame({"year": years, "month": month, "day": day}), errors="coerce")
+
+amount_columns = ["Credit ($)", "Debit ($)", "Balance ($)"]
+
+def parse_cents(amounts): # "$1,234.56" and "-1,234.56" to Int64 cents in one vectorized pass, blanks and text become <NA>
+    dollars = pd.to_numeric(amounts.astype("string").str.replace(r"[$,\s]", "", regex=True), errors="coerce")
+    return (dollars * 100).round().astype("Int64")
+
+def type_transactions(df): # Converts an assembled statement to the typed transaction schema right after extraction: Int64 cents for the amounts and a categorical account number, next to the datetime64 dates
+    for column in amount_columns:
+        if column in df.columns:
+            df[column] = parse_cents(df[column])
+    df["Account #"] = df["Account #"].replace("", np.nan).astype("category")
+    return df
+
+def trim_account_table(df): # Trims a chequing/savings page table to the rows between "Opening Balance" and "Closing Balance"
+    # Find the index of "Opening Balance" to remove it
+    opening_balance_index = df[df.apply(lambda row: "Opening Balance" in " ".join(row), axis=1)].index
+    if len(opening_balance_index) > 0:
+        df = df.drop(opening_balance_index[0]) # If "Opening Balance" is found, set the DataFrame to rows until that index.
+
+    # Find the index of "Closing Balance" to remove rows from it and after
+    end_index = df.loc[df.apply(lambda row: "Closing Balance" in " ".join(row), axis=1)].index
+    if not end_index.empty:
+        df = df.loc[:end_index.values[0] - 1]
+
+    return df
+
+def clean_account_table(df, year, year2, account_number): # Assembles the joined page tables of a chequing/savings statement, with Date/Description/Credit/Debit/Balance columns, into its transactions. Shared by both account engines
+    df.insert(1, "Account #", "") # Insert new column for Account Numbers
+
+    # Fixes multiline concatenation - a transaction's description lines come before the line holding its amounts
+    desc = df.iloc[:, 2].fillna("").str.strip()
+    has_desc = desc != ""
+    has_amount = (df.iloc[:, 3].fillna("").str.strip() != "") | (df.iloc[:, 4].fillna("").str.strip() != "")
+    groups = has_amount.shift(1, fill_value=False).cumsum() # Each run of lines ends at a line with an amount
+    started = (has_desc & ~has_amount).groupby(groups).transform("any") # The run has description lines waiting for their amount
+    members = started & has_amount.groupby(groups).transform("any") # Runs that never reach an amount are left as they are
+    heads = members & has_amount
+    df = merge_transaction_lines(df, groups, heads, members, date_col=df.columns[0], desc_col=df.columns[2])
+    df.iloc[(heads | (has_desc & has_amount & ~members)).values, 1] = account_number # Merged transactions and single-line transactions get the account number
+    df["Date"] = normalize_statement_dates(df["Date"], year, year2)
+
+    # Final cleanup
+    df = df[df.iloc[:, 2].str.strip() != '']
+    df = df[df.iloc[:, 2].str.strip() != 'No activity for this period']
+
+    return df
+
+def assemble_account_tables(tables, year, year2, account_number): # Page tables read with fewer columns, such as a 4 column table from a lower ladder rung, get their missing columns as blanks so every page lines up
+    tables = [table.reindex(columns=account_columns, fill_value="") for table in tables]
+    return [type_transactions(clean_account_table(join_page_tables(tables), year, year2, account_number))]
+
+@profiled()
+def extract_account_tables_with_camelot(document, year, year2, account_number, pages=None): # Function to extract tables from the PDF using Camelot in stream mode and perform initial processing. Returns the page tables of the pages given (all by default) for assemble_account_tables()
     
     # Set pandas display to show all columns
     pd.set_option('display.max_columns', None)
@@ -224,51 +717,25 @@ def extract_account_tables_with_camelot(pdf_path, year, year2, account_number):
 
     # Extract data from pages with camelot-py and combines
     tables_pgs = []
-    tables_pg1 = camelot.read_pdf(pdf_path, flavor='stream', pages='1', edge_tol=35, column_tol=2, row_tol=4, suppress_stdout=True) # Extract pg 1 with explicit parameters
-    cleaned_pg1 = [table for table in tables_pg1 if table.shape[1] >= 5]
-    if len(cleaned_pg1) == 0:
-        tables_pg1 = camelot.read_pdf(pdf_path, flavor='stream', pages='1', edge_tol=50, suppress_stdout=True) # When the right tables aren't found, adjust the parameters to try a better tolerance
-        cleaned_pg1 = [table for table in tables_pg1 if table.shape[1] >= 5]
-        if len(cleaned_pg1) == 0:
-            tables_pg1 = camelot.read_pdf(pdf_path, flavor='stream', pages='1', edge_tol=100, suppress_stdout=True) # When the 5 column table isn't found, adjust for a 4 column table
-            cleaned_pg1 = [table for table in tables_pg1 if table.shape[1] >= 4]
-
-    tables_pg2p = camelot.read_pdf(pdf_path, flavor='stream', pages='2-end', edge_tol=35, column_tol=2, row_tol=4, suppress_stdout=True) # Extract all pages after 1 with alternate parameters
-    cleaned_pg2p = [table for table in tables_pg2p if table.shape[1] >= 5]
-    if len(cleaned_pg2p) == 0:
-        tables_pg2p = camelot.read_pdf(pdf_path, flavor='stream', pages='2-end', edge_tol=22, column_tol=2, row_tol=4, suppress_stdout=True) # When the right tables aren't found, adjust the parameters to try a better tolerance
-        cleaned_pg2p = [table for table in tables_pg2p if table.shape[1] >= 5]
-        if len(cleaned_pg2p) == 0:
-            tables_pg2p = camelot.read_pdf(pdf_path, flavor='stream', pages='2-end', edge_tol=9, column_tol=2, row_tol=4, suppress_stdout=True) # When the right tables aren't found, adjust the parameters to try a better tolerance
-            cleaned_pg2p = [table for table in tables_pg2p if table.shape[1] >= 4]
+    pages_pg1, pages_pg2p = first_page_split(document, pages)
+    cleaned_pg1 = read_tables_with_ladder(document, pages_pg1, account_pg1_ladder, "account_pg1", account_header_words) # Extract pg 1, adjusting the tolerances until the right tables are found
+    cleaned_pg2p = read_tables_with_ladder(document, pages_pg2p, account_pg2p_ladder, "account_pg2p", account_header_words) # Extract all pages after 1 with alternate parameters
 
     # Combines tables series
     tables_pgs.extend(cleaned_pg1)
     tables_pgs.extend(cleaned_pg2p)
 
-    if print_logs == 'on': # Print the parsing report
-        print("")
-        print("Parsing Report")
-        if len(tables_pgs) == 0:
-            print("No parsing report available")
-        else:
-            print (tables_pgs[0].parsing_report)
-        print("")
-    if print_extract == 'on': # Loop through each table and print its content
-        print("-----------------Camelot-----------------")
-        for table in tables_pgs:
-            print(table.df)
-        print("---------------Camelot End---------------")
-        print("")
+    logger.info("Parsing report: %s", tables_pgs[0].parsing_report if tables_pgs else "No parsing report available")
+    if logger.isEnabledFor(logging.DEBUG): # Log each table's content
+        logger.debug("Camelot tables:\n%s", "\n".join(str(table.df) for table in tables_pgs))
     if print_plot == 'on': # Show PDF table plot
-        try:
-            camelot.plot(tables_pgs[0], kind='textedge')
-        except Exception as e:
-            pass
-        try:
-            camelot.plot(tables_pgs[1], kind='textedge')
-        except Exception as e:
-            pass
+        import camelot
+        import matplotlib.pyplot as plt
+        for table in tables_pgs[:2]:
+            try:
+                camelot.plot(table, kind='textedge')
+            except Exception as e:
+                logger.warning("Couldn't plot a camelot table | %s", e)
         plt.show(block=True)
 
     dataframes = []
@@ -279,8 +746,7 @@ def extract_account_tables_with_camelot(pdf_path, year, year2, account_number):
 
         # Find the index of the header row
         header_index = table.df[table.df.apply(lambda row: all(header in " ".join(row) for header in headers), axis=1)].index
-        if print_logs == 'on':
-            print("Header index: " + str(header_index))
+        logger.info("Header index: %s", header_index)
         if len(header_index) > 0:
             table.df = table.df.iloc[header_index[0]:] # If the header row is found, set the DataFrame to rows starting from that index
             try: # Fix for PDF extracts that concat Date & Description columns
@@ -294,21 +760,15 @@ def extract_account_tables_with_camelot(pdf_path, year, year2, account_number):
                     is_match = table.df.iloc[0].isin(["Date\nDescription"]) # Check if the first row contains the specified string
                     col_index = int(is_match[is_match].index[0]) # Get the column index where the match is True
                     table.df[col_index] = table.df[col_index].str.replace(r'.*\n', '', regex=True)
-                    if print_logs == 'on':
-                        print("---------")
-                        print("Fix for concatenated Date & Description columns:")
-                        print(table.df)
+                    logger.info("Fix for concatenated Date & Description columns:\n%s", table.df)
                 else:
                     is_match = table.df.iloc[0].str.contains(r'.*\nDate', case=False, na=False)
                     if is_match.any():
                         col_index = int(is_match[is_match].index[0]) # Get the column index where the match is True
                         table.df[col_index] = table.df[col_index].str.replace(r'.*\nDate', 'Date', regex=True)
-                        if print_all == 'on':
-                            print("---------")
-                            print("Fix for concatenated Date & vertical first column:")
-                            print(table.df)
+                        logger.debug("Fix for concatenated Date & vertical first column:\n%s", table.df)
             except ValueError: # Handle the case where the column name is not found
-                print(r"Column 'Date\nDescription' not found")
+                logger.warning(r"Column 'Date\nDescription' not found")
         else:
             continue # If the header row is not found, skip this table
 
@@ -325,87 +785,87 @@ def extract_account_tables_with_camelot(pdf_path, year, year2, account_number):
                 selected_columns.append(new_col_name)
         table.df = table.df[selected_columns] # Create a new DataFrame with only the desired columns
 
-        # Find the index of "Opening Balance" to remove it
-        opening_balance_index = table.df[table.df.apply(lambda row: "Opening Balance" in " ".join(row), axis=1)].index
-        if len(opening_balance_index) > 0:
-            table.df = table.df.drop(opening_balance_index[0]) # If "Opening Balance" is found, set the DataFrame to rows until that index.
+        table.df = trim_account_table(table.df)
+        
+        dataframes.append(table.df) # Append the DataFrame to the list
 
-        # Find the index of "Closing Balance" to remove rows from it and after
-        end_index = table.df.loc[table.df.apply(lambda row: "Closing Balance" in " ".join(row), axis=1)].index
-        if not end_index.empty:
-            table.df = table.df.loc[:end_index.values[0] - 1]
+        logger.debug("Page %s table:\n%s", table.page, table.df)
+        
+    return dataframes
 
-        #Append the year to the "Date" column for non-empty rows
-        if year == year2:
-            table.df["Date"] = [f"{date}, {year}" if (date.strip() and date != "Date") else date for date in table.df["Date"]]
+def group_word_lines(words, y_tolerance=3): # Groups pdfplumber words into lines by their top coordinate, in reading order
+    lines = []
+    for word in sorted(words, key=lambda word: (word["top"], word["x0"])):
+        if lines and word["top"] - lines[-1][0]["top"] <= y_tolerance:
+            lines[-1].append(word)
         else:
-            table.df["Date"] = [f"{date}, {year2}" if "Jan" in date and (date.strip() and date != "Date") else f"{date}, {year}" if (date.strip() and date != "Date") else date for date in table.df["Date"]]
+            lines.append([word])
+    return [sorted(line, key=lambda word: word["x0"]) for line in lines]
+
+def find_account_columns(line): # Returns [(left boundary, column name)] from a Date/Description/Withdrawals/Deposits/Balance header line, or None if the line isn't a header
+    positions = {}
+    for i, word in enumerate(line):
+        for header_word, column in account_header_words.items():
+            if word["text"].startswith(header_word) and column not in positions:
+                x1 = word["x1"]
+                if i + 1 < len(line) and line[i + 1]["text"] == "($)" and line[i + 1]["x0"] - x1 < 10: # Amount headers span "Withdrawals ($)"
+                    x1 = line[i + 1]["x1"]
+                positions[column] = (word["x0"], x1)
+    if "Description" not in positions or "Balance ($)" not in positions or ("Credit ($)" not in positions and "Debit ($)" not in positions):
+        return None
+
+    boundaries = [(float("-inf"), "Date"), (positions["Description"][0] - 2, "Description")]
+    amount_columns = sorted((positions[column], column) for column in ["Credit ($)", "Debit ($)", "Balance ($)"] if column in positions)
+    for i, ((x0, x1), column) in enumerate(amount_columns): # Amounts are right aligned under their headers, so split halfway between neighbouring headers
+        left = x0 - 2 if i == 0 else (amount_columns[i - 1][0][1] + x0) / 2
+        boundaries.append((left, column))
+    return boundaries
+
+@profiled()
+def extract_account_tables_with_pdfplumber(document, year, year2, account_number, pages=None): # Builds account page tables straight from word coordinates, slicing rows under the header's column positions instead of running camelot
+    dataframes = []
 
-        table.df.insert(1, "Account #", "") # Insert new column for Account Numbers
+    for page_number in document.page_numbers(pages or '1-end'):
+        lines = group_word_lines(document.page_words(page_number))
+        boundaries = None
+        rows = []
+        last_top = None
+        row_pitches = []
+        for line in lines:
+            columns = find_account_columns(line)
+            if columns is not None: # Start (or restart) the table under each header row
+                boundaries = columns
+                last_top = line[0]["top"]
+                continue
+            if boundaries is None:
+                continue
+            pitch = line[0]["top"] - last_top
+            if row_pitches and pitch > 3 * sorted(row_pitches)[len(row_pitches) // 2]: # A large gap means the table has ended, e.g. the page footer
+                boundaries = None
+                continue
+            row_pitches.append(pitch)
+            last_top = line[0]["top"]
 
-        # Fixes multiline concatenation - loops through the DataFrame starting from the second row
-        i = 0
-        while i < len(table.df):
-            current_desc = table.df.iloc[i, 2].strip()
-            credit = table.df.iloc[i, 3].strip()
-            debit = table.df.iloc[i, 4].strip()
-
-            # Start of a potential multi-line transaction
-            if current_desc and not credit and not debit:
-                full_desc = [current_desc]
-                full_date = [table.df.iloc[i, 0].strip()]
-                start_idx = i
-                found_end = False
-
-                j = i + 1
-                while j < len(table.df):
-                    desc = table.df.iloc[j, 2].strip()
-                    credit = table.df.iloc[j, 3].strip()
-                    debit = table.df.iloc[j, 4].strip()
-
-                    if desc:
-                        full_desc.append(desc)
-                        full_date.append(table.df.iloc[j, 0].strip())
-
-                    # If we find a row with credit or debit — it's the end of this transaction
-                    if credit or debit:
-                        # Merge descriptions and date
-                        table.df.iloc[j, 2] = " | ".join(full_desc)
-                        table.df.iloc[j, 0] = " ".join([d for d in full_date if d])
-                        table.df.iloc[j, 1] = account_number
-                        found_end = True
-
-                        # Clear all earlier lines
-                        for k in range(start_idx, j):
-                            table.df.iloc[k, 2] = ''
-                            table.df.iloc[k, 0] = ''
-                            table.df.iloc[k, 1] = ''
-                        break
-
-                    j += 1
-
-                i = j + 1 if found_end else i + 1
-            else:
-                # Single-line transaction: just assign account number
-                if current_desc:
-                    table.df.iloc[i, 1] = account_number
-                i += 1
-
-        # Final cleanup
-        table.df = table.df[table.df.iloc[:, 2].str.strip() != '']
-        table.df = table.df[table.df.iloc[:, 2].str.strip() != 'No activity for this period']
-        
-        dataframes.append(table.df) # Append the DataFrame to the list
+            row = {column: [] for column in account_columns}
+            for word in line:
+                center = (word["x0"] + word["x1"]) / 2
+                column = [name for left, name in boundaries if left <= center][-1]
+                row[column].append(word["text"])
+            rows.append({column: " ".join(words) for column, words in row.items()})
+
+        if not rows:
+            continue
+
+        df = pd.DataFrame(rows, columns=account_columns)
+        df = trim_account_table(df)
+        dataframes.append(df)
+
+        logger.debug("Page %s table:\n%s", page_number, df)
 
-        if print_page == 'on': # Loop through each table and print its content
-            print("")
-            print(f"---------Page {table.page} processed data:----------")
-            print(table.df)
-            print(f"-------Page {table.page} processed data End:--------")
-        
     return dataframes
 
-def extract_credit_tables_with_camelot(pdf_path, year, year2, account_number):
+@profiled()
+def extract_credit_tables_with_camelot(document, year, year2, account_number, pages=None): # Reads the Visa/Mastercard page tables of the pages given (all by default) for assemble_credit_tables()
     
     # Set pandas display to show all columns
     pd.set_option('display.max_columns', None)
@@ -414,42 +874,26 @@ def extract_credit_tables_with_camelot(pdf_path, year, year2, account_number):
 
     # Extract data from pages with camelot-py and combines
     tables_pgs = []
-    table_areas = ['50, 595, 360, 35']
-    table_areas2 = ['50, 608, 360, 35']
-    column_bounds = ['96, 125, 306']
     
-    tables_pg1 = camelot.read_pdf(pdf_path, flavor='stream', table_areas=table_areas, columns=column_bounds, pages='1', edge_tol=1, column_tol=0, row_tol=6, suppress_stdout=True, split_text=True) # Extract pg 1 with explicit parameters
-    cleaned_pg1 = [table for table in tables_pg1 if table.shape[1] >= 3]
-    tables_pg2p = camelot.read_pdf(pdf_path, flavor='stream', table_areas=table_areas2, columns=column_bounds, pages='2-end', edge_tol=1, column_tol=0, row_tol=6, suppress_stdout=True, split_text=True) # Extract all pages after 1 with alternate parameters
-    cleaned_pg2p = [table for table in tables_pg2p if table.shape[1] >= 3]
+    pages_pg1, pages_pg2p = first_page_split(document, pages)
+    cleaned_pg1 = read_tables_with_ladder(document, pages_pg1, credit_pg1_ladder, "credit_pg1", credit_header_words) # Extract pg 1 with explicit parameters
+    cleaned_pg2p = read_tables_with_ladder(document, pages_pg2p, credit_pg2p_ladder, "credit_pg2p", credit_header_words) # Extract all pages after 1 with alternate parameters
 
     # Combines tables series
     tables_pgs.extend(cleaned_pg1)
     tables_pgs.extend(cleaned_pg2p)
 
-    if print_all == 'on': # Print the parsing report
-        print("")
-        print("Parsing Report")
-        if len(tables_pgs) == 0:
-            print("No parsing report available")
-        else:
-            print (tables_pgs[0].parsing_report)
-        print("")
-    if print_extract == 'on': # Loop through each table and print its content
-        print("-----------------Camelot-----------------")
-        for table in tables_pgs:
-            print(table.df)
-        print("---------------Camelot End---------------")
-        print("")
+    logger.debug("Parsing report: %s", tables_pgs[0].parsing_report if tables_pgs else "No parsing report available")
+    if logger.isEnabledFor(logging.DEBUG): # Log each table's content
+        logger.debug("Camelot tables:\n%s", "\n".join(str(table.df) for table in tables_pgs))
     if print_plot == 'on': # Show PDF table plot
-        try:
-            camelot.plot(tables_pgs[0], kind='textedge')
-        except Exception as e:
-            pass
-        try:
-            camelot.plot(tables_pgs[1], kind='textedge')
-        except Exception as e:
-            pass
+        import camelot
+        import matplotlib.pyplot as plt
+        for table in tables_pgs[:2]:
+            try:
+                camelot.plot(table, kind='textedge')
+            except Exception as e:
+                logger.warning("Couldn't plot a camelot table | %s", e)
         plt.show(block=True)
 
     dataframes = []
@@ -459,8 +903,7 @@ def extract_credit_tables_with_camelot(pdf_path, year, year2, account_number):
             continue
 
         header_index = table.df[table.df.apply(lambda row: row.str.contains("ACTIVITY DESCRIPTION", case=True).any(), axis=1)].index # Find the index of the header row
-        if print_all == 'on':
-            print("Header index: " + str(header_index))
+        logger.debug("Header index: %s", header_index)
         if len(header_index) > 0:
             table.df = table.df.iloc[header_index[0]:] # If the header row is found, set the DataFrame to rows starting from that index
         else:
@@ -501,85 +944,50 @@ def extract_credit_tables_with_camelot(pdf_path, year, year2, account_number):
         if not end_index_nb.empty:
             table.df = table.df.loc[:end_index_nb.values[0] - 1]
 
-        #Append the year to the "Date" column for non-empty rows
-        if year == year2:
-            table.df["Date"] = [f"{date}, {year}" if (date.strip() and date != "Date") else date for date in table.df["Date"]]
-        else:
-            table.df["Date"] = [f"{date}, {year2}" if "JAN" in date and (date.strip() and date != "Date") else f"{date}, {year}" if (date.strip() and date != "Date") else date for date in table.df["Date"]]
-
-        # Convert the 'Date' column to the new format only if it matches the original format
-        table.df['Date'] = table.df['Date'].apply(lambda x: datetime.strptime(x, '%b %d, %Y').strftime('%d %b, %Y') if re.match(r'^[A-Z]{3} \d{2}, \d{4}$', x) else x)
+        dataframes.append(table.df) # Append the DataFrame to the list
 
-        table.df.insert(1, "Account #", "") # Insert new column for Account Numbers
-        table.df.insert(4, "Debit ($)", "") # Insert new debit column for splitting negative values to
-        table.df.insert(5, "Balance ($)", "") # Insert a balance column to match the account statements for consistency in processing
+        logger.debug("Page %s table:\n%s", table.page, table.df)
+        
+    return dataframes
 
-        # Loops through the DataFrame to fix multiline concatenation, split out negative values to the debit column, add the account number
-        table.df = table.df.reset_index(drop=True)
-        table.df['Description'] = table.df['Description'].str.replace('\n', ' | ')
+def assemble_credit_tables(tables, year, year2, account_number): # Assembles a Visa/Mastercard statement's page tables, joined in page order, into its transactions
+    df = join_page_tables(tables)
 
-        i = 0
-        while i < len(table.df):
-            desc = table.df.loc[i, 'Description'].strip()
-            credit = table.df.loc[i, 'Credit ($)'].strip()
-            debit = table.df.loc[i, 'Debit ($)'].strip()
-
-            # Only proceed if we have a valid transaction (has an amount)
-            if desc and (credit or debit):
-                # Fix negative credit to debit
-                if credit.startswith('-'):
-                    table.df.loc[i, 'Debit ($)'] = credit[1:]
-                    table.df.loc[i, 'Credit ($)'] = ''
-
-                table.df.loc[i, 'Account #'] = account_number
-                base_index = i
-                full_desc = [desc]
-                full_date = [table.df.loc[i, 'Date'].strip()]
-
-                j = i + 1
-                while j < len(table.df):
-                    desc_j = table.df.loc[j, 'Description'].strip()
-                    credit_j = table.df.loc[j, 'Credit ($)'].strip()
-                    debit_j = table.df.loc[j, 'Debit ($)'].strip()
-
-                    # If the next row has no amount but has a description, it's part of this transaction
-                    if desc_j and not credit_j and not debit_j:
-                        full_desc.append(desc_j)
-                        full_date.append(table.df.loc[j, 'Date'].strip())
-                        # Clear out the extra row
-                        table.df.loc[j, 'Description'] = ''
-                        table.df.loc[j, 'Date'] = ''
-                        table.df.loc[j, 'Account #'] = ''
-                    else:
-                        # We hit a new transaction (or end), stop merging
-                        break
+    df.insert(1, "Account #", "") # Insert new column for Account Numbers
+    df.insert(4, "Debit ($)", "") # Insert new debit column for splitting negative values to
+    df.insert(5, "Balance ($)", "") # Insert a balance column to match the account statements for consistency in processing
 
-                    j += 1
+    # Loops through the DataFrame to fix multiline concatenation, split out negative values to the debit column, add the account number
+    df = df.reset_index(drop=True)
+    df['Description'] = df['Description'].str.replace('\n', ' | ')
 
-                # Apply merged description and date
-                table.df.loc[base_index, 'Description'] = ' | '.join(full_desc)
-                table.df.loc[base_index, 'Date'] = ' '.join([d for d in full_date if d])
+    desc = df['Description'].str.strip()
+    credit = df['Credit ($)'].str.strip()
+    has_amount = (credit != "") | (df['Debit ($)'].str.strip() != "")
+    heads = (desc != "") & has_amount # A transaction starts on the line with its amount
+    continuations = (desc != "") & ~has_amount # Following lines with only a description belong to it
+    groups = (~continuations).cumsum() # Any other line ends the transaction
+    members = heads.groupby(groups).transform("any")
+    df = merge_transaction_lines(df, groups, heads, members)
+    df["Date"] = normalize_statement_dates(df["Date"], year, year2)
 
-                i = j  # Continue from where we left off
-            else:
-                i += 1
+    negative = heads & credit.str.startswith('-') # Fix negative credit to debit
+    df.loc[negative, 'Debit ($)'] = credit[negative].str[1:]
+    df.loc[negative, 'Credit ($)'] = ''
+    df.loc[heads, 'Account #'] = account_number
 
-        table.df = table.df[table.df.iloc[:, 2].str.strip() != ''] # Drop rows where the description is empty
-        table.df = table.df[table.df.iloc[:, 2].str.strip() != 'No activity for this period'] # Drop rows where the description indicates no activity
-        table.df = table.df[table.df.iloc[:, 2].str.strip() != 'SUBTOTAL OF MONTHLY ACTIVITY'] # Drop rows where the description indicates no activity
-        table.df = table.df[~table.df.iloc[:, 2].astype(str).str.contains(' - CO-APPLICANT', na=False)] # Drop rows where the description contains "CO-APPLICANT"
+    df = df[df.iloc[:, 2].str.strip() != ''] # Drop rows where the description is empty
+    df = df[df.iloc[:, 2].str.strip() != 'No activity for this period'] # Drop rows where the description indicates no activity
+    df = df[df.iloc[:, 2].str.strip() != 'SUBTOTAL OF MONTHLY ACTIVITY'] # Drop rows where the description indicates no activity
+    df = df[~df.iloc[:, 2].astype(str).str.contains(' - CO-APPLICANT', na=False)] # Drop rows where the description contains "CO-APPLICANT"
+    df = type_transactions(df)
 
-        dataframes.append(table.df) # Append the DataFrame to the list
+    logger.debug("Processed data:\n%s", df)
 
-        if print_page == 'on': # Loop through each table and print its content
-            print("")
-            print(f"---------Page {table.page} processed data:----------")
-            print(table.df)
-            print(f"-------Page {table.page} processed data End:--------")
-        
-    return dataframes
+    return [df]
 
-def extract_credit_line_tables_with_camelot(pdf_path, year, year2, account_number):
+@profiled()
+def extract_credit_line_tables_with_camelot(document, year, year2, account_number):
     
     # Set pandas display to show all columns
     pd.set_option('display.max_columns', None)
@@ -589,38 +997,26 @@ def extract_credit_line_tables_with_camelot(pdf_path, year, year2, account_numbe
     # Extract data from pages with camelot-py and combines
     tables_pgs = []
     
-    tables_pg1 = camelot.read_pdf(pdf_path, flavor='stream', pages='1', edge_tol=1, column_tol=0, row_tol=6, suppress_stdout=True) # Extract pg 1 with explicit parameters
+    tables_pg1 = read_tables(document, pages='1', edge_tol=1, column_tol=0, row_tol=6, suppress_stdout=True) # Extract pg 1 with explicit parameters
     cleaned_pg1 = [table for table in tables_pg1 if table.shape[1] >= 3]
-    tables_pg2p = camelot.read_pdf(pdf_path, flavor='stream', pages='2-end', edge_tol=1, column_tol=0, row_tol=6, suppress_stdout=True) # Extract all pages after 1 with alternate parameters
+    tables_pg2p = read_tables(document, pages='2-end', edge_tol=1, column_tol=0, row_tol=6, suppress_stdout=True) # Extract all pages after 1 with alternate parameters
     cleaned_pg2p = [table for table in tables_pg2p if table.shape[1] >= 3]
 
     # Combines tables series
     tables_pgs.extend(cleaned_pg1)
     tables_pgs.extend(cleaned_pg2p)
 
-    if print_all == 'on': # Print the parsing report
-        print("")
-        print("Parsing Report")
-        if len(tables_pgs) == 0:
-            print("No parsing report available")
-        else:
-            print (tables_pgs[0].parsing_report)
-        print("")
-    if print_extract == 'on': # Loop through each table and print its content
-        print("-----------------Camelot-----------------")
-        for table in tables_pgs:
-            print(table.df)
-        print("---------------Camelot End---------------")
-        print("")
+    logger.debug("Parsing report: %s", tables_pgs[0].parsing_report if tables_pgs else "No parsing report available")
+    if logger.isEnabledFor(logging.DEBUG): # Log each table's content
+        logger.debug("Camelot tables:\n%s", "\n".join(str(table.df) for table in tables_pgs))
     if print_plot == 'on': # Show PDF table plot
-        try:
-            camelot.plot(tables_pgs[0], kind='textedge')
-        except Exception as e:
-            pass
-        try:
-            camelot.plot(tables_pgs[1], kind='textedge')
-        except Exception as e:
-            pass
+        import camelot
+        import matplotlib.pyplot as plt
+        for table in tables_pgs[:2]:
+            try:
+                camelot.plot(table, kind='textedge')
+            except Exception as e:
+                logger.warning("Couldn't plot a camelot table | %s", e)
         plt.show(block=True)
 
     dataframes = []
@@ -630,8 +1026,7 @@ def extract_credit_line_tables_with_camelot(pdf_path, year, year2, account_numbe
             continue
 
         header_index = table.df[table.df.apply(lambda row: row.str.contains("ACTIVITY DESCRIPTION", case=True).any(), axis=1)].index # Find the index of the header row
-        if print_all == 'on':
-            print("Header index: " + str(header_index))
+        logger.debug("Header index: %s", header_index)
         if len(header_index) > 0:
             table.df = table.df.iloc[header_index[0]:] # If the header row is found, set the DataFrame to rows starting from that index
         else:
@@ -668,15 +1063,6 @@ def extract_credit_line_tables_with_camelot(pdf_path, year, year2, account_numbe
         if not end_index_nb.empty:
             table.df = table.df.loc[:end_index_nb.values[0] - 1]
 
-        #Append the year to the "Date" column for non-empty rows
-        if year == year2:
-            table.df["Date"] = [f"{date}, {year}" if (date.strip() and date != "Date") else date for date in table.df["Date"]]
-        else:
-            table.df["Date"] = [f"{date}, {year2}" if "JAN" in date and (date.strip() and date != "Date") else f"{date}, {year}" if (date.strip() and date != "Date") else date for date in table.df["Date"]]
-
-        # Convert the 'Date' column to the new format only if it matches the original format
-        table.df['Date'] = table.df['Date'].apply(lambda x: datetime.strptime(x, '%b %d, %Y').strftime('%d %b, %Y') if re.match(r'^[A-Z]{3} \d{2}, \d{4}$', x) else x)
-
         table.df.insert(1, "Account #", "") # Insert new column for Account Numbers
         table.df.insert(4, "Debit ($)", "") # Insert new debit column for splitting negative values to
         table.df.insert(5, "Balance ($)", "") # Insert a balance column to match the account statements for consistency in processing
@@ -684,283 +1070,959 @@ def extract_credit_line_tables_with_camelot(pdf_path, year, year2, account_numbe
         # Loops through the DataFrame starting from the second row to fix multiline concatenation, split out negative values to the debit column, add the account number
         table.df = table.df.reset_index(drop=True)
         table.df['Description'] = table.df['Description'].str.replace('\n', ' | ')
-        for i in range(1, len(table.df)):
-            if re.search(r"\b\d{23}\b", table.df.loc[i, 'Description']):
-                if i + 1 in table.df.index and table.df.loc[i+1, 'Description'].startswith('Foreign Currency'): # Searches for Foreign currency lines and merges them with their transaction line
-                    table.df.loc[i, 'Description'] = table.df.loc[i, 'Description'] + ' | ' + table.df.loc[i+1, 'Description']
-                    table.df.loc[i+1, 'Description'] = ''
-                table.df.loc[i-1, 'Description'] = table.df.loc[i-1, 'Description'] + ' | ' + table.df.loc[i, 'Description']
-                table.df.loc[i, 'Description'] = ''
-            if table.df.loc[i, 'Description'].startswith('CASH BACK') and i + 1 in table.df.index and re.search(r"\d{10}", table.df.loc[i+1, 'Description']): # Searches for cash back credits and merges them with thier transaction line
-                table.df.loc[i, 'Description'] = table.df.loc[i, 'Description'] + ' | ' + table.df.loc[i+1, 'Description']
-                table.df.loc[i+1, 'Description'] = ''
-            if table.df.loc[i, 'Description'].startswith('OFFER RONA') and i + 1 in table.df.index and re.search(r".*\d{10,}", table.df.loc[i+1, 'Description']): # Searches for cash back credits and merges them with thier transaction line
-                table.df.loc[i, 'Description'] = table.df.loc[i, 'Description'] + ' | ' + table.df.loc[i+1, 'Description']
-                table.df.loc[i+1, 'Description'] = ''
-            if table.df.loc[i, 'Date'].strip() and table.df.loc[i, 'Credit ($)'].strip(): # Check if the date and amount rows are empty for the current row
-                table.df.iloc[i, 1] = account_number # Add in the account number
-            if table.df.loc[i, 'Credit ($)'].startswith('-'): #Check if the value is negative
-                table.df.loc[i, 'Debit ($)'] = table.df.loc[i, 'Credit ($)'][1:] # Copy the value to the debit column and make it positive
-                table.df.loc[i, 'Credit ($)'] = '' # Erase the original value
+        attached = match_continuation_rules(table.df['Description'], continuation_rules) # Reference number, foreign currency, cash back and offer lines join their transaction line
+        attached.iloc[0] = False # The header row never joins anything
+        groups = (~attached).cumsum()
+        members = attached.groupby(groups).transform("any")
+        table.df = merge_transaction_lines(table.df, groups, ~attached & members, members)
+
+        rows = pd.Series(table.df.index > 0, index=table.df.index) # Skips the header row
+        table.df.loc[rows & (table.df['Date'].str.strip() != '') & (table.df['Credit ($)'].str.strip() != ''), 'Account #'] = account_number # Add in the account number where there's a date and amount
+        table.df["Date"] = normalize_statement_dates(table.df["Date"], year, year2)
+        negative = rows & table.df['Credit ($)'].str.startswith('-') # Copy negative values to the debit column and make them positive
+        table.df.loc[negative, 'Debit ($)'] = table.df.loc[negative, 'Credit ($)'].str[1:]
+        table.df.loc[negative, 'Credit ($)'] = ''
         table.df = table.df[table.df.iloc[:, 2].str.strip() != ''] # Drop rows where the description is empty
         table.df = table.df[table.df.iloc[:, 2].str.strip() != 'No activity for this period'] # Drop rows where the description indicates no activity
         table.df = table.df[table.df.iloc[:, 2].str.strip() != 'SUBTOTAL OF MONTHLY ACTIVITY'] # Drop rows where the description indicates no activity
 
         dataframes.append(table.df) # Append the DataFrame to the list
 
-        if print_page == 'on': # Loop through each table and print its content
-            print("")
-            print(f"---------Page {table.page} processed data:----------")
-            print(table.df)
-            print(f"-------Page {table.page} processed data End:--------")
+        logger.debug("Page %s processed data:\n%s", table.page, table.df)
         
     return dataframes
 
-def extract_credit_line_tables_with_pdfplumber(pdf_path, year, year2, account_number):
+@profiled()
+def extract_credit_line_tables_with_pdfplumber(document, year, year2, account_number, pages=None): # Reads the Royal Credit Line page tables of the pages given (all by default) for assemble_credit_line_tables()
     pd.set_option('display.max_columns', None)
     pd.set_option('display.max_rows', None)
     pd.set_option('display.width', None)
 
     dataframes = []
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-
-            # Extract tables with adjusted tolerance settings
-            raw_table = page.extract_table({"vertical_strategy": "explicit", 
-                                            "explicit_vertical_lines": [45,84,258,375,457,520,598],
-                                            "horizontal_strategy": "text", 
-                                            "text_y_tolerance": 4, 
-                                            "text_x_tolerance": 4, 
-                                            "intersection_x_tolerance": 2, 
-                                            "edge_min_length": 20
-                                            })
-
-            if not raw_table:
-                continue  # Skip if no table is found
-
-            df = pd.DataFrame(raw_table)
-            df = df.dropna(how='all')  # Drop empty rows
-
-            # Find header row
-            header_index = None
-            for i, row in df.iterrows():
-                if any(re.search(r"Interest/Fees/Insurance", str(cell), re.IGNORECASE) for cell in row):
-                    header_index = i
-                    break
-
-            if header_index is None:
-                continue  # Skip if no header found
-
-            df = df.iloc[header_index:]  # Keep only rows from header onward
-
-            df.columns = df.iloc[0]  # Set new column headers
-            df = df[1:].reset_index(drop=True)  # Remove header row from data
-
-            # Rename important columns
-            column_mapping = {
-                "Date": "Date",
-                "Description": "Description",
-                "Interest/Fees/Insurance($)": "Interest/Fees/Insurance ($)",
-                "Withdrawals($)": "Credit ($)",
-                "Payments($)": "Debit ($)",
-                "Balanceowing($)": "Balance ($)"
-            }
-            df.rename(columns={col: column_mapping[col] for col in df.columns if col in column_mapping}, inplace=True)
-
-            # Remove unwanted rows (e.g., summary totals)
-            #df = df[~df.apply(lambda row: "Balance ($)" in " ".join(row.astype(str)), axis=1)]
-
-            # Append year to dates
-            if "Date" in df.columns:
-                df["Date"] = df["Date"].apply(lambda x: f"{x}, {year}" if x.strip() and x != "Date" else x)
-
-                # Add a space before the month if missing (e.g., "22Nov" → "22 Nov")
-                df["Date"] = df["Date"].apply(lambda x: re.sub(r"(\d{1,2})([A-Z][a-z]{2})", r"\1 \2", x) if isinstance(x, str) else x)
-
-                # Convert to a standard date format
-                df["Date"] = df["Date"].apply(
-                    lambda x: datetime.strptime(x, "%b %d, %Y").strftime("%d %b, %Y") if re.match(r"^[A-Z]{3} \d{2}, \d{4}$", x) else x
-                )
-
-            # Drop empty rows
-            df = df[df["Description"].str.strip() != ""]
-            df = df[df["Balance ($)"].str.strip() != "1of"]
-            # df = df[df["Date"].str.strip() != ""]
-            df = df[df["Interest/Fees/Insurance ($)"].str.strip() != "inthisstatementforyourreco"]
-
-            # Fixes multiline concatenation - loops through the DataFrame
-            df = df.reset_index(drop=True)  # Ensure index is continuous
-            rows_to_remove = []  # Track rows to delete
-            for i in range(1, len(df)):  # Start from row 1 (skip header
-                if pd.isna(df.at[i, "Date"]) or str(df.at[i, "Date"]).strip() == "":  # If the date is missing
-                    df.at[i - 1, "Description"] += " | " + df.at[i, "Description"] # Append description to previous row
-
-                    # Merge other columns (keep the non-null value)
-                    for col in df.columns:
-                        if col not in ["Description", "Date"] and pd.notna(df.at[i, col]):
-                            df.at[i - 1, col] = df.at[i, col]
-
-                    rows_to_remove.append(i)  # Mark row for deletion
-
-            df = df.drop(rows_to_remove).reset_index(drop=True) # Remove processed rows
-
-            # Merge multiline descriptions
-            df["Description"] = df["Description"].str.replace("\n", " | ")
-
-            # Insert additional columns
-            df.insert(1, "Account #", account_number)  # Insert Account Number
-
-            # Merge the two columns into "Credit ($)", prioritizing non-null values
-            df["Credit ($)"] = df["Interest/Fees/Insurance ($)"].fillna(0) + df["Credit ($)"].fillna(0)
-
-            # Drop the old column
-            df = df.drop(columns=["Interest/Fees/Insurance ($)"])
-
-            dataframes.append(df)
-
-            if print_page == 'on': # Loop through each table and print its content
-                print("")
-                print(f"---------Processed data:----------")
-                print(df)
-                print(f"-------Processed data End:--------")
-        
+    for page_number in document.page_numbers(pages or '1-end'):
+        # Extract tables with adjusted tolerance settings
+        raw_table = document.page_table(page_number, {"vertical_strategy": "explicit", 
+                                                      "explicit_vertical_lines": [45,84,258,375,457,520,598],
+                                                      "horizontal_strategy": "text", 
+                                                      "text_y_tolerance": 4, 
+                                                      "text_x_tolerance": 4, 
+                                                      "intersection_x_tolerance": 2, 
+                                                      "edge_min_length": 20
+                                                      })
+
+        if not raw_table:
+            continue  # Skip if no table is found
+
+        df = pd.DataFrame(raw_table)
+        df = df.dropna(how='all')  # Drop empty rows
+
+        # Find header row
+        header_index = None
+        for i, row in df.iterrows():
+            if any(re.search(r"Interest/Fees/Insurance", str(cell), re.IGNORECASE) for cell in row):
+                header_index = i
+                break
+
+        if header_index is None:
+            continue  # Skip if no header found
+
+        df = df.iloc[header_index:]  # Keep only rows from header onward
+
+        df.columns = df.iloc[0]  # Set new column headers
+        df = df[1:].reset_index(drop=True)  # Remove header row from data
+
+        # Rename important columns
+        column_mapping = {
+            "Date": "Date",
+            "Description": "Description",
+            "Interest/Fees/Insurance($)": "Interest/Fees/Insurance ($)",
+            "Withdrawals($)": "Credit ($)",
+            "Payments($)": "Debit ($)",
+            "Balanceowing($)": "Balance ($)"
+        }
+        df.rename(columns={col: column_mapping[col] for col in df.columns if col in column_mapping}, inplace=True)
+
+        # Remove unwanted rows (e.g., summary totals)
+        #df = df[~df.apply(lambda row: "Balance ($)" in " ".join(row.astype(str)), axis=1)]
+
+        # Drop empty rows
+        df = df[df["Description"].str.strip() != ""]
+        df = df[df["Balance ($)"].str.strip() != "1of"]
+        # df = df[df["Date"].str.strip() != ""]
+        df = df[df["Interest/Fees/Insurance ($)"].str.strip() != "inthisstatementforyourreco"]
+
+        dataframes.append(df)
+
+        logger.debug("Page %s table:\n%s", page_number, df)
+    
     return dataframes
 
-def post_extraction_processing(dataframes): # Handles additional formatting of full dataframe series to clean the data once its been standardized and combined
+def assemble_credit_line_tables(tables, year, year2, account_number): # Assembles a Royal Credit Line statement's page tables, joined in page order, into its transactions
+    df = join_page_tables(tables)
+
+    # Fixes multiline concatenation - lines without a date continue the transaction above them
+    df = df.reset_index(drop=True)  # Ensure index is continuous
+    has_date = df["Date"].fillna("").astype(str).str.strip() != ""
+    has_date.iloc[:1] = True # The first row always starts a transaction
+    groups = has_date.cumsum()
+    for col in df.columns: # Merge other columns, keeping the last non-empty value in each transaction
+        if col not in ["Description", "Date"]:
+            values = df[col].where(df[col].fillna("").astype(str).str.strip() != "")
+            df[col] = values.groupby(groups).transform("last").where(has_date, df[col]).fillna(df[col])
+    df = merge_transaction_lines(df, groups, has_date, pd.Series(True, index=df.index))
+    df = df[has_date].reset_index(drop=True) # Remove merged rows
+    df["Date"] = normalize_statement_dates(df["Date"], year, year2)
+
+    # Merge multiline descriptions
+    df["Description"] = df["Description"].str.replace("\n", " | ")
+
+    # Insert additional columns
+    df.insert(1, "Account #", account_number)  # Insert Account Number
+    df = type_transactions(df)
+
+    # Add interest, fees and insurance into "Credit ($)" and drop the old column. Either one alone is kept as is, and a row with neither stays blank
+    df["Credit ($)"] = df["Credit ($)"].add(parse_cents(df.pop("Interest/Fees/Insurance ($)")), fill_value=0)
+
+    logger.debug("Processed data:\n%s", df)
+
+    return [df]
+
+headers_set1 = ["Date", re.escape(".*"), "Description", "Withdrawals ($)", "Deposits ($)", "Balance ($)"]
+headers_set2 = [r"*DATE", re.escape(".*"), "ACTIVITY DESCRIPTION", "AMOUNT ($)", re.escape(".*"), re.escape(".*")]
+headers_set3 = ["Date", re.escape(".*"), "Description", "Interest/Fees/Insurance ($)", "Credit ($)", "Deposits ($)", "Balance ($)"]
+header_filter_strings = list(dict.fromkeys(headers_set1 + headers_set2 + headers_set3)) # Rows containing any of these strings are repeated page headers or noise
+header_filter_pattern = re.compile("|".join(re.escape(header) for header in header_filter_strings)) # Entries are matched as plain substrings, so they're escaped into one alternation
+
+@profiled("header_filter")
+def filter_header_rows(data, pattern=header_filter_pattern): # Drops every row whose space-joined text cells contain one of the header strings. Each row is joined once and tested against all the strings in a single regex pass. Typed dates, account numbers and amounts can't hold header text, so only the text columns are joined
+    text = data.select_dtypes(include="object").astype(str)
+    if data.empty or text.empty:
+        return data
+    row_text = text.iloc[:, 0].str.cat([text[column] for column in text.columns[1:]], sep=" ")
+    return data[~row_text.str.contains(pattern, regex=True)]
+
+transaction_columns = ["Date", "Account #", "Description", "Credit ($)", "Debit ($)", "Balance ($)"]
+
+@profiled("post")
+def post_extraction_processing(dataframes, state=None): # Handles additional formatting of full dataframe series to clean the data once its been standardized and combined. When streaming, pass the same state dict with every chunk so the column check and Date forward-fill carry across chunks
+    if state is None:
+        state = {}
     
     for df in dataframes:
         if df.index.duplicated().any():
-            print("Duplicate index values found in a Dataframe")
+            logger.warning("Duplicate index values found in a Dataframe")
 
     dataframes = [df.reset_index(drop=True) for df in dataframes] # Reset the index of each DataFrame
 
     data = pd.concat(dataframes, ignore_index=True) # Concatenate all dataframes into a single DataFrame
+    statement_numbers = pd.Series(np.repeat(np.arange(len(dataframes)), [len(df) for df in dataframes])) # Each dataframe holds one statement, rows keep their concat index through the filters below
+    statement_years = pd.Series(np.repeat([df.attrs.get("statement_year", np.nan) for df in dataframes], [len(df) for df in dataframes]), dtype=object)
     
-    if pd.isna(data.iloc[0, -1]): # Drop the last column of NaN values
+    if "drop_last_column" not in state and not data.empty: # Decided on the first row of the output, like the combined run. Only a column past the six transaction columns can be dropped, since typed amounts are <NA> on header rows
+        state["drop_last_column"] = len(data.columns) > len(transaction_columns) and pd.isna(data.iloc[0, -1])
+    if state.get("drop_last_column"): # Drop the last column of NaN values
         data = data.drop(data.columns[-1], axis=1)
     data = data.replace('', np.nan) # Replace empty strings with NaN
-    headers_set1 = ["Date", re.escape(".*"), "Description", "Withdrawals ($)", "Deposits ($)", "Balance ($)"]
-    headers_set2 = [r"*DATE", re.escape(".*"), "ACTIVITY DESCRIPTION", "AMOUNT ($)", re.escape(".*"), re.escape(".*")]
-    headers_set3 = ["Date", re.escape(".*"), "Description", "Interest/Fees/Insurance ($)", "Credit ($)", "Deposits ($)", "Balance ($)"]
-    
-    for headers_to_exclude in [headers_set1, headers_set2, headers_set3]:
-        for header in headers_to_exclude:
-            data = data[~data.apply(lambda row: header in " ".join(row.astype(str)), axis=1)]
+    data = filter_header_rows(data)
 
-    data.columns = ["Date", "Account #", "Description", "Credit ($)", "Debit ($)", "Balance ($)"]
+    data.columns = transaction_columns
+    data["Account #"] = data["Account #"].astype("category") # Statements with different account numbers concatenate to object
 
-    data["Date"].fillna(method='ffill', inplace=True) # Forward-fill missing dates in the "Date" column
+    data["Date"] = data["Date"].ffill() # Forward-fill missing dates in the "Date" column
+    if pd.notna(state.get("last_date", np.nan)): # Rows at the top of a chunk take the last date of the previous chunk
+        data["Date"] = data["Date"].fillna(state["last_date"])
+    if not data.empty:
+        state["last_date"] = data["Date"].iloc[-1]
 
+    if dedupe_transactions == 'on':
+        data = drop_seen_transactions(data, statement_numbers[data.index], state.setdefault("seen_transactions", set()))
+
+    data.attrs["statement_years"] = statement_years[data.index].to_numpy() # Each row's statement year, which the Parquet output partitions on
     return data
 
+def drop_seen_transactions(data, statement_numbers, seen): # Drops rows whose key is already in seen and adds the rest. The key hashes the transaction columns plus how many times the same transaction came before it in its statement, so a repeat within one statement is kept while the same rows from an overlapping statement are dropped
+    with profile_stage("dedupe"):
+        if data.empty:
+            return data
+        row_hashes = pd.util.hash_pandas_object(data[transaction_columns], index=False).to_numpy()
+        occurrences = pd.Series(row_hashes).groupby([statement_numbers.to_numpy(), row_hashes]).cumcount().to_numpy()
+        keys = pd.util.hash_pandas_object(pd.DataFrame({"row": row_hashes, "occurrence": occurrences}), index=False).tolist()
+        keep = []
+        for key in keys: # One set lookup per row, checked as we go so overlapping statements in the same chunk are caught too
+            keep.append(key not in seen)
+            seen.add(key)
+        if not all(keep):
+            logger.info("Dropped %s transactions already found in an earlier statement", len(keep) - sum(keep))
+        return data[keep]
+
+output_extensions = {'': '', 'gzip': '.gz', 'zstd': '.zst'}
+csv_date_format = "%d %b, %Y" # Dates are written out like "05 Oct, 2019"
+
+class TransactionWriter: # Appends cleaned transactions to the output CSV chunk by chunk. Rows go to a .part file that's only renamed into place by close(), so an interrupted run never leaves a partial CSV that looks finished. With append=True rows are added to an existing output in place instead, for watch mode
+    def __init__(self, csv_path, compression='', append=False):
+        if compression not in output_extensions:
+            raise ValueError(f"Unknown output_compression '{compression}', use '', 'gzip' or 'zstd'")
+        self.compression = compression
+        self.append = append
+        self.path = csv_path + output_extensions[compression]
+        self.temp_path = self.path if append else self.path + '.part'
+        self.file = None
+        self.header_written = append and os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def open(self):
+        mode = 'at' if self.append else 'wt'
+        if self.compression == 'gzip':
+            return gzip.open(self.temp_path, mode, encoding='utf-8', newline='')
+        if self.compression == 'zstd':
+            import zstandard # Optional, only needed for .csv.zst output
+            return zstandard.open(self.temp_path, mode, encoding='utf-8', newline='')
+        return open(self.temp_path, mode, encoding='utf-8', newline='')
+
+    def write(self, data): # The header row is written with the first chunk
+        if self.file is None:
+            self.file = self.open()
+        data = data.assign(**{column: format_cents(data[column]) for column in amount_columns})
+        data.to_csv(self.file, index=False, header=not self.header_written, date_format=csv_date_format)
+        self.header_written = True
+        self.file.flush()
+
+    def close(self): # Returns the finished file path, or None when nothing was written
+        if self.file is None:
+            return None
+        self.file.close()
+        self.file = None
+        if not self.append:
+            os.replace(self.temp_path, self.path)
+        return self.path
+
+def format_cents(cents): # Int64 cents back to "1,234.56" text for the CSV
+    return (cents / 100).map("{:,.2f}".format, na_action="ignore")
+
+def dollar_transactions(data): # The typed transactions with text columns as strings and amounts in dollars, for the Parquet output
+    typed = pd.DataFrame({"Date": data["Date"], "Account #": data["Account #"].astype("string"), "Description": data["Description"].astype("string")})
+    for column in amount_columns:
+        typed[column] = data[column] / 100
+    return typed
+
+class ParquetTransactionWriter: # Writes typed transactions into a Hive style dataset, one folder per account=<Account #>/year=<statement year>, so readers can load a single partition and a statement's transactions stay together even when its period spans New Year. Every chunk becomes a new row group, and the dataset is built in a .part folder that's renamed into place by close()
+    def __init__(self, dataset_path):
+        import pyarrow # Optional, only needed for Parquet output
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = dataset_path
+        self.temp_path = dataset_path + '.part'
+        self.schema = pyarrow.schema([("Date", pyarrow.date32()), ("Account #", pyarrow.string()), ("Description", pyarrow.string())] + [(column, pyarrow.float64()) for column in amount_columns])
+        self.writers = {}
+
+    def partition_path(self, account, year): # Account numbers are percent-encoded since they can contain spaces and '*'
+        account = "__HIVE_DEFAULT_PARTITION__" if pd.isna(account) else quote(str(account), safe='')
+        year = "__HIVE_DEFAULT_PARTITION__" if pd.isna(year) else str(int(year))
+        return os.path.join(self.temp_path, f"account={account}", f"year={year}")
+
+    def write(self, data):
+        typed = dollar_transactions(data)
+        years = data.attrs.get("statement_years", typed["Date"].dt.year) # Transaction years when the statement years weren't carried through
+        for (account, year), partition in typed.groupby([typed["Account #"], years], sort=False, dropna=False):
+            key = (account, year)
+            if key not in self.writers:
+                folder = self.partition_path(account, year)
+                os.makedirs(folder, exist_ok=True)
+                self.writers[key] = self.pq.ParquetWriter(os.path.join(folder, "part-0.parquet"), self.schema)
+            self.writers[key].write_table(self.pa.Table.from_pandas(partition, schema=self.schema, preserve_index=False))
+
+    def close(self): # Returns the finished dataset path, or None when nothing was written
+        if not self.writers:
+            return None
+        for writer in self.writers.values():
+            writer.close()
+        os.replace(self.temp_path, self.path)
+        return self.path
+
+def extract_account_tables(document, year, year2, account_number, pages=None): # Reads chequing/savings page tables with the account_engine. Camelot also handles layouts the pdfplumber engine can't find a header row in
+    dataframes = []
+    if account_engine == 'pdfplumber':
+        dataframes = extract_account_tables_with_pdfplumber(document, year, year2, account_number, pages)
+    if not dataframes:
+        dataframes = extract_account_tables_with_camelot(document, year, year2, account_number, pages)
+    return dataframes
+
+statement_year_pattern = re.compile(r", (20\d{2})") # Years in the statement period, e.g. "October 5, 2019"
+
+statement_detectors = [ # Statement types in priority order: a document is the first type whose anchor appears anywhere in its text. Each one declares its anchor (matched case-insensitively, within a line), its account number pattern with the number in group 1, its year pattern, the extractor that reads its page tables and the assembler that joins them into transactions. A new type only needs an entry here
+    {"type": "account", "anchor": r"Your\s+RBC\s+personal\s+.*?\s*account\s+statement", "account_number": re.compile(r"Your account number:\s*(\d{5}-\d{7})"), "years": statement_year_pattern, "extractor": extract_account_tables, "assembler": assemble_account_tables},
+    {"type": "credit", "anchor": r"RBC.*?(?:Visa|Mastercard)", "account_number": re.compile(r"\b(\d{4}\s\d{2}\*\*\s\*\*\*\*\s\d{4})\b", re.IGNORECASE), "years": statement_year_pattern, "extractor": extract_credit_tables_with_camelot, "assembler": assemble_credit_tables},
+    {"type": "credit_line", "anchor": r"Your Royal Credit Line", "account_number": re.compile(r"Your loan account number:\s*(\d{8}-\d{3})", re.IGNORECASE), "years": statement_year_pattern, "extractor": extract_credit_line_tables_with_pdfplumber, "assembler": assemble_credit_line_tables},
+]
+statement_detector_ranks = {detector["type"]: rank for rank, detector in enumerate(statement_detectors)}
+statement_anchor_pattern = re.compile("|".join(f"(?=(?P<{detector['type']}>{detector['anchor']}))" for detector in statement_detectors), re.IGNORECASE) # Every anchor in one alternation, so classification is a single pass over the text however many types there are. The lookaheads keep a lower ranked match from consuming text that starts a higher ranked anchor
+
+status_messages = {"processed": "Processed %s", "not_processed": "Didn't process %s", "skipped": "Skipped %s, no statement type", "error": "Failed to process %s", "duplicate": "Skipped %s, same contents as %s"}
+
+def process_pdf(pdf_path, split_pages=0, statement=None, pages=None, page_cache_path=None, pdf_data=None): # Converts a single PDF, or one page range of it (see convert_pdf), and returns (status, dataframes, details). Runs in a worker process when parallel processing is on, so everything it returns must be picklable. Log records, warnings and the stage profile are collected into details rather than written, so they reach the run log the same way from a worker
+    global active_profile
+    collector = LogRecordCollector()
+    handlers, logger.handlers = logger.handlers, [collector]
+    run_profile = active_profile
+    if profile_run == 'on':
+        if profile_memory == 'on' and not tracemalloc.is_tracing(): # Started here so worker processes trace too
+            tracemalloc.start()
+        active_profile = new_profile()
+    file_profile = active_profile
+    start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            status, dataframes = convert_pdf(pdf_path, split_pages, statement, pages, page_cache_path, pdf_data)
+    finally:
+        logger.handlers = handlers
+        active_profile = run_profile
+    details = {"file": pdf_path, "status": status, "seconds": round(time.perf_counter() - start, 3), "warnings": list(dict.fromkeys(f"{warning.category.__name__}: {warning.message}" for warning in caught)), "records": collector.records}
+    if pages is not None:
+        details["pages"] = pages
+    if file_profile is not None:
+        details["profile"] = {"cpu": round(time.process_time() - cpu_start, 3), **file_profile}
+    return status, dataframes, details
+
+def log_file_result(details): # Replays a file's collected log records, then logs its status line with the timing and warnings attached for the run log
+    for record in details.pop("records", []):
+        record.details = {"file": details["file"]}
+        logger.handle(record)
+    message = status_messages[details["status"]] + (" (cached)" if details.get("cached") else " in %.2fs" % details["seconds"])
+    logger.info(message, details["file"], extra={"details": details})
+
+def convert_pdf(pdf_path, split_pages=0, statement=None, pages=None, page_cache_path=None, pdf_data=None): # Classifies and extracts a single PDF into (status, dataframes). When split_pages is set and the statement is longer, only its first split_pages pages are read and ("split", {statement, page_count, tables}) is returned, so the other page ranges can be read in parallel by calling this again with the statement and their pages, which returns ("pages", tables). With a page_cache_path, the PDF is read from that sidecar where it can be and anything newly read is saved to it. pdf_data is the file's contents when they were already read into memory
+    statement_type = "unknown"
+    document = None
+    recording = None
+    read_error = False # Opening or classifying failed, which is reported as an error so it isn't cached like a PDF with no statement type
+    try:
+        with profile_stage("open"):
+            recording = load_page_cache(page_cache_path) if page_cache_path else None
+            document = StatementDocument(pdf_path if pdf_data is None else io.BytesIO(pdf_data), recording) # The PDF is parsed once here and shared by classification and extraction
+        if statement is None:
+            count_profile("pages", document.page_count)
+            #statement_year, statement_year2, statement_acct_num, statement_type = pypdf_extract_from_pdf(pdf_path)
+            statement_year, statement_year2, statement_acct_num, statement_type, pdf_extract = pdfplumber_extract_from_pdf(document)
+        else: # A later page range of a split statement, already classified from its first pages
+            statement_type, statement_year, statement_year2, statement_acct_num = statement
+    except ValueError as ve:
+        logger.error("PyPDF2 extract error: %s", ve, exc_info=True)
+        read_error = True
+    except IndexError as ie:
+        logger.error("PyPDF2 extract error: %s", ie, exc_info=True)
+        read_error = True
+    except Exception as e:
+        logger.error("An unexpected PyPDF2 extract error occurred: %s", e, exc_info=True)
+        read_error = True
+
+    try:
+        if read_error:
+            return "error", []
+        if statement_type not in statement_detector_ranks:
+            return "skipped", []
+        statement = (statement_type, statement_year, statement_year2, statement_acct_num)
+        extractor = statement_detectors[statement_detector_ranks[statement_type]]["extractor"]
+        split = pages is None and split_pages and document.page_count > split_pages
+        if split:
+            pages = f"1-{split_pages}"
+        dataframes_camelot = extractor(document, statement_year, statement_year2, statement_acct_num, pages)
+        if split:
+            return "split", {"statement": statement, "page_count": document.page_count, "tables": dataframes_camelot}
+        if pages is not None:
+            return "pages", dataframes_camelot
+        return assemble_statement(statement, dataframes_camelot)
+    except Exception as e:
+        logger.error("A pdfplumber error occurred processing the file: %s | %s", pdf_path, e, exc_info=True)
+        return "error", []
+    finally:
+        if document is not None:
+            document.close()
+            if document.pdf is None:
+                count_profile("page_cache_hits")
+            elif document.recording_changed:
+                save_page_cache(page_cache_path, recording)
+
+def assemble_statement(statement, tables): # Joins a statement's page tables, in page order, into (status, dataframes). A split statement is only assembled once every page range is back, so transactions that continue across a page break still come out whole
+    assembler = statement_detectors[statement_detector_ranks[statement[0]]]["assembler"]
+    dataframes = assembler(tables, *statement[1:]) if tables else []
+    for df in dataframes:
+        df.attrs["statement_year"] = statement[1] # The first year of the statement period, kept for the Parquet partitions
+    if dataframes:
+        return "processed", dataframes
+    else:
+        return "not_processed", []
+
+def statement_sources(paths_or_bytes): # Expands the inputs of iter_transactions() into single statements: folders become the PDFs inside them and raw bytes are wrapped in a file object
+    if isinstance(paths_or_bytes, (str, bytes, bytearray, memoryview, os.PathLike)) or hasattr(paths_or_bytes, "read"):
+        paths_or_bytes = [paths_or_bytes]
+    for source in paths_or_bytes:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            yield io.BytesIO(source)
+        elif hasattr(source, "read"):
+            yield source
+        elif os.path.isdir(source):
+            yield from get_pdf_files_recursive(os.fspath(source))
+        else:
+            yield os.fspath(source)
+
+def iter_transactions(paths_or_bytes): # Library entry point: yields each transaction as a dict with the output CSV's columns, one file at a time as soon as it's extracted. Takes a PDF path, a folder, the bytes or binary file object of a PDF, or a list of any of these. Files that can't be converted are logged on the pdf2csv logger and skipped
+    state = {} # Shared by every file so the Date forward-fill carries across them, like the CSV output
+    for source in statement_sources(paths_or_bytes):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            status, dataframes = convert_pdf(source)
+        logger.info(status_messages[status], source)
+        if dataframes:
+            yield from post_extraction_processing(dataframes, state).to_dict("records")
+
+def count_pdf_pages(pdf_path): # Page count of a PDF without laying out any page, 0 if it can't be opened
+    try:
+        with StatementDocument(pdf_path) as document:
+            return len(document.pages)
+    except Exception:
+        return 0
+
+def get_file_hash(pdf_path): # Hashes the file contents, so renamed or moved statements still hit the cache
+    file_hash = hashlib.sha256()
+    with open(pdf_path, 'rb') as pdf_file:
+        for chunk in iter(lambda: pdf_file.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def read_pdf_file(pdf_path): # Prefetch stage: reads a whole file into memory and hashes it in one pass. Runs in a prefetch thread, so it doesn't log and any error is raised to whoever collects the result
+    with open(pdf_path, 'rb') as pdf_file:
+        pdf_data = pdf_file.read()
+    return pdf_data, hashlib.sha256(pdf_data).hexdigest()
+
+def code_source(code): # inspect.getsource(), except a class is read as its methods' sources, since finding a class's own source parses the whole module
+    if not inspect.isclass(code):
+        return inspect.getsource(code)
+    methods = [member.fget if isinstance(member, property) else member for member in vars(code).values()]
+    return "".join(inspect.getsource(method) for method in methods if inspect.isfunction(method))
+
+def get_cache_fingerprint(): # Hashes the extraction code, including the recording and replay of page tables, and every setting it reads, so cached results are invalidated whenever the extractors or their settings change
+    fingerprint = hashlib.sha256()
+    fingerprint.update(str(cache_version).encode())
+    for function in [convert_pdf, match_continuation_rules, merge_transaction_lines, normalize_statement_dates, parse_cents, type_transactions, clean_account_table, group_word_lines, find_account_columns, extract_account_tables_with_pdfplumber, StatementDocument, document_stream_class, generate_text_edges, read_tables_with_ladder, read_page_with_ladder, layout_fingerprint, read_tables, RecordedTable, load_page_cache, save_page_cache, classify_statement_text, pick_statement_years, pdfplumber_extract_from_pdf, first_page_split, join_page_tables, trim_account_table, assemble_statement, assemble_account_tables, assemble_credit_tables, assemble_credit_line_tables, extract_account_tables, extract_account_tables_with_camelot, extract_credit_tables_with_camelot, extract_credit_line_tables_with_pdfplumber]:
+        fingerprint.update(code_source(function).encode())
+    fingerprint.update(repr([[(detector["type"], detector["anchor"], detector["account_number"].pattern, detector["years"].pattern, detector["extractor"].__name__) for detector in statement_detectors], account_engine, account_header_words, account_columns, amount_columns, continuation_rules, statement_date_pattern, month_numbers, headers, cc_headers, cl_headers, header_filter_strings, layout_cache, account_pg1_ladder, account_pg2p_ladder, credit_pg1_ladder, credit_pg2p_ladder, credit_header_words, camelot_layout_params, pd.__version__, version('camelot-py'), version('pdfplumber')]).encode())
+    return fingerprint.hexdigest()[:16]
+
+def load_cached_result(cache_path): # Returns the cached (status, dataframes) for a file, or None on a miss
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            result = pickle.load(cache_file)
+        os.utime(cache_path) # Marks the entry as recently used for eviction
+        return result
+    except FileNotFoundError:
+        return None
+    except Exception as e: # A truncated or unreadable entry is treated as a miss and rewritten
+        logger.warning("Ignoring unreadable cache entry %s | %s", cache_path, e)
+        return None
+
+def save_cached_result(cache_path, result): # Writes to a temporary file first so an interrupted run never leaves a half written entry
+    temp_path = cache_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump(result, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        logger.warning("Couldn't write cache entry %s | %s", cache_path, e)
+
+def get_page_cache_fingerprint(): # Hashes only the code and settings that read the PDFs, so page sidecars outlive changes to the table building and cleanup code
+    fingerprint = hashlib.sha256()
+    fingerprint.update(str(cache_version).encode())
+    for function in [StatementDocument, document_stream_class, generate_text_edges, read_tables, RecordedTable, load_page_cache, save_page_cache]:
+        fingerprint.update(code_source(function).encode())
+    fingerprint.update(repr([camelot_layout_params, version('camelot-py'), version('pdfplumber')]).encode())
+    return "pages-" + fingerprint.hexdigest()[:16]
+
+def load_page_cache(page_cache_path): # Returns a file's recorded page data, or an empty recording on a miss
+    try:
+        with gzip.open(page_cache_path, 'rb') as cache_file:
+            recording = pickle.load(cache_file)
+        os.utime(page_cache_path) # Marks the entry as recently used for eviction
+        return recording
+    except FileNotFoundError:
+        return {}
+    except Exception as e: # A truncated or unreadable sidecar is treated as a miss and rewritten
+        logger.warning("Ignoring unreadable page cache %s | %s", page_cache_path, e)
+        return {}
+
+def save_page_cache(page_cache_path, recording): # Merges in what's already saved, since the other page ranges of a split statement save to the same sidecar, then writes through a temporary file
+    saved = load_page_cache(page_cache_path)
+    for kind, entries in recording.items():
+        if isinstance(entries, dict):
+            saved.setdefault(kind, {}).update(entries)
+        else:
+            saved[kind] = entries
+    temp_path = f"{page_cache_path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(temp_path, 'wb', compresslevel=1) as cache_file:
+            pickle.dump(saved, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, page_cache_path)
+    except Exception as e:
+        logger.warning("Couldn't write page cache %s | %s", page_cache_path, e)
+
+cache_folder_pattern = re.compile(r"(?:pages-)?[0-9a-f]{16}") # Names of the results and page sidecar folders, see get_cache_fingerprint() and get_page_cache_fingerprint()
+
+def prune_cache(cache_root, active_dirs): # Removes results and page sidecars from older extractor versions, then evicts least recently used entries past cache_max_mb. Only folders named like the cache's own are touched, since cache_dir may be a folder that holds other things
+    for entry in os.scandir(cache_root):
+        if entry.is_dir(follow_symlinks=False) and cache_folder_pattern.fullmatch(entry.name) and entry.path not in active_dirs:
+            for cached in os.scandir(entry.path):
+                os.remove(cached.path)
+            os.rmdir(entry.path)
+
+    entries = sorted((cached.stat().st_mtime, cached.stat().st_size, cached.path) for active_dir in active_dirs if os.path.isdir(active_dir) for cached in os.scandir(active_dir) if cached.is_file() and cached.name != 'layouts.json') # The remembered layouts aren't a result entry, so they're never evicted
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_size <= cache_max_mb * 1024 * 1024:
+            break
+        os.remove(path)
+        total_size -= size
+
+def rounded_profile(profile): # Rounds the stage timings of a profile for the report
+    return {"stages": {stage: {key: round(value, 4) if isinstance(value, float) else value for key, value in entry.items()} for stage, entry in profile["stages"].items()}, "counters": profile["counters"]}
+
+def write_profile_report(report_path, run_profile, file_profiles, seconds): # Writes the JSON profile of a run and logs the slowest files with their stage breakdown
+    totals = new_profile()
+    for file_profile in file_profiles: # Stage and counter totals over every converted file
+        for stage, entry in file_profile["stages"].items():
+            total = totals["stages"].setdefault(stage, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            for key, value in entry.items():
+                total[key] = max(total.get(key, 0), value) if key == "peak_mb" else total.get(key, 0) + value
+        for counter, value in file_profile["counters"].items():
+            totals["counters"][counter] = totals["counters"].get(counter, 0) + value
+    slowest = sorted(file_profiles, key=lambda file_profile: file_profile["wall"], reverse=True)[:profile_top]
+    report = {"seconds": round(seconds, 3), "files_profiled": len(file_profiles), "run": rounded_profile(run_profile), "file_totals": rounded_profile(totals), "slowest": [file_profile["file"] for file_profile in slowest], "files": [{**file_profile, **rounded_profile(file_profile)} for file_profile in file_profiles]}
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    logger.info("Profile of %d converted files saved to %s", len(file_profiles), report_path)
+    logger.info("Stage totals: %s", ", ".join(f"{stage} {entry['wall']:.2f}s" for stage, entry in list(totals["stages"].items()) + list(run_profile["stages"].items())))
+    logger.info("%8s%8s%7s%9s  file", "wall", "cpu", "pages", "retries")
+    for file_profile in slowest:
+        logger.info("%7.2fs%7.2fs%7d%9d  %s", file_profile['wall'], file_profile['cpu'], file_profile['counters'].get('pages', 0), file_profile['counters'].get('camelot_retries', 0), file_profile['file'])
+        logger.info("%s%s", " " * 34, ", ".join(f"{stage} {entry['wall']:.2f}s" for stage, entry in sorted(file_profile["stages"].items(), key=lambda item: -item[1]["wall"])))
+
 def process_pdfs(): # Function to process PDFs and save data to CSV
-    pdf_files = get_pdf_files_recursive(PDF_DIR)
-    all_dataframes = []
-    not_processed = []
+    global active_profile
+    run_start = time.perf_counter()
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") # Calculate current timestamp
 
     # Logging related items
     not_processed_log_path = PDF_DIR + r'\!pdf2csv_unprocessed.txt' # Construct the log file path based on the PDF file path
     error_log_path = os.path.join(PDF_DIR, r'\!pdf2csv_error_log.txt') # Construct the log file path based on the PDF file path
-    with open(error_log_path, 'w'):
-        pass
-    logging.basicConfig(filename=error_log_path, level=logging.ERROR, format='%(asctime)s - %(message)s') # Set up logging to write errors to the log file in the same directory as the PDF file
+    run_log_path = os.path.join(PDF_DIR, f"{CSV_FILE}_{timestamp}_run_log.jsonl") # Structured log of the run next to the output
+    log_handlers = start_run_logging(error_log_path, run_log_path)
+    status_counts = dict.fromkeys(status_messages, 0)
 
-    #for pdf_path in pdf_files: # Proceses all files in the given directory
-    for pdf_path in tqdm(pdf_files, desc="Processing files", unit="file", leave=False): # Proceses all files in the given directory
-        try:
-            #statement_year, statement_year2, statement_acct_num, statement_type = pypdf_extract_from_pdf(pdf_path)
-            statement_year, statement_year2, statement_acct_num, statement_type, pdf_extract = pdfplumber_extract_from_pdf(pdf_path)
-        except ValueError as ve:
-            if print_errors == 'on': # Prints except errors when enabled
-                print("PyPDF2 extract error: ", ve)
-        except IndexError as ie:
-            if print_errors == 'on': # Prints except errors when enabled
-                print("PyPDF2 extract error: ", ie)
-        except Exception as e:
-            if print_errors == 'on': # Prints except errors when enabled
-                print("An unexpected PyPDF2 extract error occurred: ", e)
+    # Profiling related items
+    file_profiles = []
+    if profile_run == 'on':
+        active_profile = new_profile()
+        if profile_memory == 'on':
+            tracemalloc.start()
 
-        try:
-            if statement_type == 'account':
-                dataframes_camelot = extract_account_tables_with_camelot(pdf_path, statement_year, statement_year2, statement_acct_num)
-                #continue
-            elif statement_type == 'credit':
-                dataframes_camelot = extract_credit_tables_with_camelot(pdf_path, statement_year, statement_year2, statement_acct_num)
-                #continue
-            elif statement_type == 'credit_line':
-                #dataframes_camelot = extract_credit_line_tables_with_camelot(pdf_path, statement_year, statement_year2, statement_acct_num)
-                dataframes_camelot = extract_credit_line_tables_with_pdfplumber(pdf_path, statement_year, statement_year2, statement_acct_num)
-                #pass
+    all_dataframes = []
+    not_processed = []
+    pdf_files = [] # Files to convert in discovery order, growing while PDF_DIR is still being walked
+
+    # Cache related items
+    results = {}
+    first_paths = {} # Content hash -> first path found with it
+    cache_paths = {}
+    page_cache_paths = {}
+    cached_files = set()
+    if cache_results == 'on':
+        cache_root = cache_dir or os.path.join(PDF_DIR, '!pdf2csv_cache')
+        active_cache_dirs = [os.path.join(cache_root, get_cache_fingerprint())]
+        if cache_pages == 'on':
+            active_cache_dirs.append(os.path.join(cache_root, get_page_cache_fingerprint()))
+        for active_cache_dir in active_cache_dirs:
+            os.makedirs(active_cache_dir, exist_ok=True)
+
+    def admit(pdf_path, file_hash=None): # Hashes a newly found file, unless the prefetch stage already did, and adds it to pdf_files unless it's a duplicate. Returns True when it still has to be parsed
+        if file_hash is None and (dedupe_files == 'on' or cache_results == 'on'):
+            with profile_stage("hash"):
+                try:
+                    file_hash = get_file_hash(pdf_path)
+                except OSError as e:
+                    logger.warning("Couldn't hash %s | %s", pdf_path, e)
+        if dedupe_files == 'on' and file_hash is not None: # The first path found with each content hash is converted, later copies are skipped before any parsing
+            first_path = first_paths.setdefault(file_hash, pdf_path)
+            if first_path != pdf_path:
+                status_counts["duplicate"] += 1
+                logger.info(status_messages["duplicate"], pdf_path, first_path, extra={"details": {"file": pdf_path, "status": "duplicate", "duplicate_of": first_path}})
+                return False
+        pdf_files.append(pdf_path)
+        if cache_results == 'on' and file_hash is not None:
+            if cache_pages == 'on':
+                page_cache_paths[pdf_path] = os.path.join(active_cache_dirs[1], file_hash + '.pkl.gz')
+            cache_paths[pdf_path] = os.path.join(active_cache_dirs[0], file_hash + '.pkl')
+            if os.path.exists(cache_paths[pdf_path]): # Hits are loaded when their turn comes, so a fully cached archive isn't held in memory
+                cached_files.add(pdf_path)
+                return False
+        return True
+
+    def store_result(pdf_path, result): # Logs a finished file and keeps its (status, dataframes). Errors aren't cached so they're retried on the next run
+        status, dataframes, details = result
+        if "profile" in details:
+            file_profiles.append({"file": pdf_path, "status": status, "wall": details["seconds"], **details["profile"]})
+        log_file_result(details)
+        results[pdf_path] = (status, dataframes)
+        if status != "error" and pdf_path in cache_paths:
+            save_cached_result(cache_paths[pdf_path], (status, dataframes))
+
+    # Output related items
+    csv_path = os.path.join(PDF_DIR, f"{CSV_FILE}_{timestamp}.csv")
+    writers = []
+    if save_file == 'on':
+        writers.append(TransactionWriter(csv_path, output_compression))
+        if output_parquet == 'on':
+            writers.append(ParquetTransactionWriter(os.path.join(PDF_DIR, f"{CSV_FILE}_{timestamp}_parquet")))
+    post_processing_state = {}
+    files_with_data = 0
+    next_file = 0
+
+    def write_transactions(dataframes): # Cleans one chunk of dataframes and appends it to the output
+        data = post_extraction_processing(dataframes, post_processing_state)
+        with profile_stage("write"):
+            for writer in writers:
+                writer.write(data)
+        logger.debug("Combined data:\n%s", data)
+
+    def write_ready_results(): # Hands finished files on in discovery order so the output doesn't depend on which worker finished first
+        nonlocal next_file, files_with_data
+        while next_file < len(pdf_files) and (pdf_files[next_file] in results or pdf_files[next_file] in cached_files):
+            pdf_path = pdf_files[next_file]
+            next_file += 1
+            result = results.pop(pdf_path, None)
+            if result is None:
+                result = load_cached_result(cache_paths[pdf_path])
+                if result is not None:
+                    log_file_result({"file": pdf_path, "status": result[0], "cached": True})
+            if result is None: # The cache entry went missing or unreadable since the lookup
+                store_result(pdf_path, process_pdf(pdf_path, page_cache_path=page_cache_paths.get(pdf_path)))
+                result = results.pop(pdf_path)
+            status, dataframes_camelot = result
+            status_counts[status] += 1
+            if status == "processed":
+                files_with_data += 1
+                if output_stream == 'on':
+                    write_transactions(dataframes_camelot)
+                else:
+                    all_dataframes.extend(dataframes_camelot)
+            elif status == "not_processed":
+                not_processed.append(pdf_path)
+
+    split_statements = {} # Statements being read as page ranges, by file, until every range is back
+
+    def collect_page_range(pdf_path, first_page, result, submit): # Keeps one page range of a split statement. The first range brings the classification and page count, so the other ranges are queued with submit(). Returns the assembled (status, dataframes, details) once every range is back, otherwise None
+        status, payload, details = result
+        if "profile" in details:
+            file_profiles.append({"file": f"{pdf_path} (pages {details.get('pages', f'1-{page_split}')})", "status": status, "wall": details["seconds"], **details.pop("profile")})
+        if status == "split":
+            split = split_statements[pdf_path] = {"statement": payload["statement"], "tables": {1: payload["tables"]}, "details": details, "waiting": 0, "error": False}
+            for first in range(page_split + 1, payload["page_count"] + 1, page_split):
+                submit(pdf_path, first, f"{first}-{min(first + page_split - 1, payload['page_count'])}", payload["statement"])
+                split["waiting"] += 1
+        else:
+            split = split_statements[pdf_path]
+            split["waiting"] -= 1
+            split["details"]["records"] += details["records"]
+            split["details"]["warnings"] = list(dict.fromkeys(split["details"]["warnings"] + details["warnings"]))
+            split["details"]["seconds"] = round(split["details"]["seconds"] + details["seconds"], 3)
+            if status == "pages":
+                split["tables"][first_page] = payload
             else:
-                if print_logs == 'on':
-                    print("\nNo statement type")
-                continue
-            if dataframes_camelot:
-                if print_logs == 'on':
-                    print(f"Processed {pdf_path}\n")
-                all_dataframes.extend(dataframes_camelot)
+                split["error"] = True
+        if split["waiting"]:
+            return None
+        del split_statements[pdf_path]
+        status, dataframes = "error", []
+        if not split["error"]:
+            try:
+                status, dataframes = assemble_statement(split["statement"], [table for first in sorted(split["tables"]) for table in split["tables"][first]])
+            except Exception as e:
+                logger.error("A pdfplumber error occurred processing the file: %s | %s", pdf_path, e, exc_info=True)
+        split["details"]["status"] = status
+        return status, dataframes, split["details"]
+
+    max_workers = workers if workers > 0 else os.cpu_count()
+    max_queued = max_workers * 2 # Files and page ranges sent to the pool at once, enough to keep every worker busy while results are written out
+    with contextlib.ExitStack() as stack:
+        progress = stack.enter_context(tqdm(total=0, desc="Processing files", unit="file", leave=False, disable=print_progress != 'on'))
+        prefetcher = stack.enter_context(ThreadPoolExecutor(max_workers=prefetch_threads, thread_name_prefix="prefetch")) if prefetch_threads else None
+        executor = None
+        futures = {}
+        file_data = {} # Contents of the files being parsed, kept until their last page range is back
+        held_file = None # The first file to parse waits for a second one before the pool is started, so a run with one new statement doesn't pay for starting workers
+
+        def start_pool():
+            nonlocal executor
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=max_workers, initializer=configure_logging)) # Each worker classifies and extracts one PDF, or one page range of a long statement, at a time and sends its dataframes back
+
+        def submit(pdf_path, first_page=None, pages=None, statement=None): # Queues a file, or a later page range of a split statement, behind the ones already waiting
+            if first_page is None:
+                futures[executor.submit(process_pdf, pdf_path, page_split, page_cache_path=page_cache_paths.get(pdf_path), pdf_data=file_data.get(pdf_path))] = (pdf_path, None)
             else:
-                if print_logs == 'on':
-                    print(f"Didn't process {pdf_path}")
-                not_processed.append(pdf_path)
-        except Exception as e:
-            logging.error("Didn't process: %s", pdf_path)
-            if print_logs == 'on':
-                print(f"A pdfplumber error occurred processing the file: {pdf_path} |", e)
-            if print_trace == 'on':
-                traceback.print_exc()
-                print(pdf_path)
+                futures[executor.submit(process_pdf, pdf_path, 0, statement, pages, page_cache_paths.get(pdf_path), file_data.get(pdf_path))] = (pdf_path, first_page)
+
+        def collect(done): # Writer stage: stores the files whose worker futures have finished and writes out whatever is next in discovery order
+            for future in done:
+                pdf_path, first_page = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e: # The worker died or its result couldn't be sent back
+                    logger.error("A worker error occurred processing the file: %s | %s", pdf_path, e, exc_info=True)
+                    result = ("error", [], {"file": pdf_path, "status": "error", "seconds": 0.0, "warnings": [], "records": []})
+                if first_page is not None or result[0] == "split":
+                    result = collect_page_range(pdf_path, first_page, result, submit)
+                    if result is None:
+                        continue
+                file_data.pop(pdf_path, None)
+                store_result(pdf_path, result)
+                progress.update()
+                write_ready_results()
+
+        def convert_in_process(pdf_path):
+            store_result(pdf_path, process_pdf(pdf_path, page_cache_path=page_cache_paths.get(pdf_path), pdf_data=file_data.pop(pdf_path, None)))
+            progress.update()
+            write_ready_results()
+
+        def convert(pdf_path): # Starts parsing a newly found file that isn't cached
+            nonlocal held_file
+            progress.total += 1
+            progress.refresh()
+            if max_workers == 1:
+                convert_in_process(pdf_path)
+            elif executor is None and held_file is None:
+                held_file = pdf_path
+            else:
+                if executor is None:
+                    start_pool()
+                    submit(held_file)
+                while len(futures) >= max_queued: # Backpressure: wait for the workers before reading further ahead
+                    collect(wait(futures, return_when=FIRST_COMPLETED)[0])
+                submit(pdf_path)
+                collect(wait(futures, timeout=0, return_when=FIRST_COMPLETED)[0]) # Picks up whatever finished meanwhile, so output keeps flowing while discovery runs
+
+        discovered = get_pdf_files_recursive(PDF_DIR, check_header=prefetcher is None) # Prefetched files are checked from their contents
+        prefetched = collections.deque() # (path, read future) in discovery order. Reading ahead stops at prefetch_files, so it waits while the workers are behind
+        while True:
+            while len(prefetched) < (prefetch_files if prefetcher else 1):
+                with profile_stage("discover"):
+                    pdf_path = next(discovered, None)
+                if pdf_path is None:
+                    break
+                prefetched.append((pdf_path, prefetcher.submit(read_pdf_file, pdf_path) if prefetcher else None))
+            if not prefetched:
+                break
+            pdf_path, read = prefetched.popleft()
+            pdf_data = file_hash = None
+            if read is not None:
+                try:
+                    with profile_stage("read_wait"): # Only the time spent waiting on the prefetch threads
+                        pdf_data, file_hash = read.result()
+                except OSError as e:
+                    logger.warning("Couldn't read %s | %s", pdf_path, e)
+                    continue
+                if not has_pdf_header(pdf_path, pdf_data):
+                    continue
+            if admit(pdf_path, file_hash):
+                if pdf_data is not None:
+                    file_data[pdf_path] = pdf_data
+                convert(pdf_path)
+            write_ready_results()
+        if cache_results == 'on':
+            logger.info("%s of %s files found in the cache", len(cached_files), len(pdf_files))
+
+        if executor is None and held_file is not None: # The only file to parse is read in this process, unless it's long enough to split across workers
+            if page_split and count_pdf_pages(io.BytesIO(file_data[held_file]) if held_file in file_data else held_file) > page_split:
+                start_pool()
+                submit(held_file)
+            else:
+                convert_in_process(held_file)
+        while futures:
+            collect(wait(futures, return_when=FIRST_COMPLETED)[0])
 
-    if all_dataframes: # Data extract post-processing cleanup
-        combined_data = post_extraction_processing(all_dataframes)
+    if cache_results == 'on':
+        try:
+            prune_cache(cache_root, active_cache_dirs)
+        except OSError as e:
+            logger.warning("A cache cleanup error occurred | %s", e)
 
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") # Calculate current timestamp
+    if files_with_data: # Data extract post-processing cleanup
+        if all_dataframes:
+            write_transactions(all_dataframes)
 
-        csv_path = os.path.join(PDF_DIR, f"{CSV_FILE}_{timestamp}.csv")
-        if save_file == 'on':
-            combined_data.to_csv(csv_path, index=False)
-        if print_logs == 'on' and save_file == 'on':
-            print(f"Data saved to {csv_path}")
+        for writer in writers:
+            with profile_stage("write"):
+                output_path = writer.close()
+            if output_path:
+                logger.info("Data saved to %s", output_path)
 
         if not_processed:
             with open(not_processed_log_path, 'w') as file:
                 file.write("\n".join(not_processed))
-            if print_logs == 'on':
-                print(f"Unprocessed log file saved to {not_processed_log_path}")
-
-        if print_page == 'on': # Loop through each table and print its content
-            print("-------------Combined data:--------------")
-            print(combined_data)
-            print("----------End of combined data:----------")
+            logger.info("Unprocessed log file saved to %s", not_processed_log_path)
     else:
-        if print_logs == 'on':
-            print("No data extracted from any PDFs.")
+        logger.info("No data extracted from any PDFs.")
+
+    logger.info("Converted %s files in %.1fs", len(pdf_files), time.perf_counter() - run_start, extra={"details": {"event": "summary", "files": len(pdf_files), "cached": len(cached_files), **status_counts, "seconds": round(time.perf_counter() - run_start, 3)}})
+    if profile_run == 'on':
+        write_profile_report(os.path.join(PDF_DIR, f"{CSV_FILE}_{timestamp}_profile.json"), active_profile, file_profiles, time.perf_counter() - run_start)
+        active_profile = None
+        if profile_memory == 'on':
+            tracemalloc.stop()
+    stop_run_logging(log_handlers)
+
+def pdf_signature(pdf_path): # Size and modified time, which keep changing while a statement is still being written
+    stat = os.stat(pdf_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def start_pdf_watcher(pdf_dir, changed): # Puts created, modified and moved-in PDFs on the changed queue through watchdog, which uses inotify on Linux. Returns the observer, or None when watchdog isn't installed so the caller polls instead
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        return None
+
+    class PdfEventHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            path = getattr(event, "dest_path", "") or event.src_path
+            relative_path = os.path.relpath(path, pdf_dir)
+            if not event.is_directory and matches_discovery_patterns(relative_path, include_patterns) and not matches_discovery_patterns(relative_path, exclude_patterns): # Size and date limits are checked once the file has settled
+                changed.put(path)
+
+    observer = Observer()
+    observer.schedule(PdfEventHandler(), pdf_dir, recursive=True)
+    observer.start()
+    return observer
+
+def poll_pdf_changes(pdf_dir, snapshot, changed): # Polling fallback: puts PDFs whose size or modified time differ from the previous scan on the changed queue and returns the new scan
+    current = {}
+    for pdf_path in get_pdf_files_recursive(pdf_dir, check_header=False): # The header is checked once the file has settled
+        try:
+            current[pdf_path] = pdf_signature(pdf_path)
+        except OSError: # Removed between the listing and the stat
+            continue
+        if snapshot.get(pdf_path) != current[pdf_path]:
+            changed.put(pdf_path)
+    return current
 
+def load_watch_state(state_path): # Content hashes of the files already in the watch output, mapped to their paths
     try:
-        # Redirect stdout and stderr to a log file
-        log_file = 'script_log.txt'
-        with open(log_file, 'w') as log_file:
-            # Run the main script and capture the terminal output in the log file
-            subprocess.call(['python', 'pdf2csv.py'], stdout=log_file, stderr=subprocess.STDOUT)
-
-        # Move the log file to the PDF directory - not working properly, currently, due to a windows conflict
-        if os.path.exists(log_file):
-            #log_file_dest = PDF_DIR + r'\!pdf2csv_script_log.txt'
-            log_file_dest = r'\!pdf2csv_script_log.txt'
-            os.rename(log_file, log_file_dest)
-            print(f"Log file saved to: {log_file_dest}")
+        with open(state_path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+def save_watch_state(state_path, converted):
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w') as state_file:
+        json.dump(converted, state_file, indent=0)
+    os.replace(temp_path, state_path)
+
+def watch_pdfs(): # Watch mode: converts the PDFs that aren't in the persistent output yet, then waits for new or changed ones and appends their transactions once each file has settled. Stop with Ctrl+C
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    error_log_path = os.path.join(PDF_DIR, r'\!pdf2csv_error_log.txt')
+    log_handlers = start_run_logging(error_log_path, os.path.join(PDF_DIR, f"{CSV_FILE}_{timestamp}_run_log.jsonl"))
+    state_path = os.path.join(PDF_DIR, '!pdf2csv_watch_state.json')
+    converted = load_watch_state(state_path)
+    writer = TransactionWriter(os.path.join(PDF_DIR, f"{CSV_FILE}_watch.csv"), output_compression, append=True)
+    post_processing_state = {}
+    active_cache_dir = page_cache_dir = None
+    if cache_results == 'on':
+        active_cache_dir = os.path.join(cache_dir or os.path.join(PDF_DIR, '!pdf2csv_cache'), get_cache_fingerprint())
+        os.makedirs(active_cache_dir, exist_ok=True)
+        if cache_pages == 'on':
+            page_cache_dir = os.path.join(cache_dir or os.path.join(PDF_DIR, '!pdf2csv_cache'), get_page_cache_fingerprint())
+            os.makedirs(page_cache_dir, exist_ok=True)
+
+    def convert(pdf_path): # Converts one settled file unless its contents are already in the output. Errors aren't recorded, so the file is retried when it changes again
+        try:
+            if not matches_discovery_filters(os.path.relpath(pdf_path, PDF_DIR), os.stat(pdf_path)) or not has_pdf_header(pdf_path):
+                return
+            file_hash = get_file_hash(pdf_path)
+        except OSError as e:
+            logger.warning("Couldn't hash %s | %s", pdf_path, e)
+            return
+        if file_hash in converted:
+            return
+        cache_path = os.path.join(active_cache_dir, file_hash + '.pkl') if active_cache_dir else None
+        result = load_cached_result(cache_path) if cache_path else None
+        if result is not None:
+            log_file_result({"file": pdf_path, "status": result[0], "cached": True})
         else:
-            print("Log file not found.")
-    except Exception as e:
-        if print_logs == 'on':
-            print("A script log file error occurred")
+            status, dataframes, details = process_pdf(pdf_path, page_cache_path=os.path.join(page_cache_dir, file_hash + '.pkl.gz') if page_cache_dir else None)
+            log_file_result(details)
+            result = (status, dataframes)
+            if status != "error" and cache_path:
+                save_cached_result(cache_path, result)
+        status, dataframes = result
+        if status == "error":
+            return
+        if status == "processed":
+            writer.write(post_extraction_processing(dataframes, post_processing_state))
+            logger.info("Appended %s to %s", pdf_path, writer.path)
+        converted[file_hash] = pdf_path
+        save_watch_state(state_path, converted)
+
+    changed = queue.Queue()
+    observer = start_pdf_watcher(PDF_DIR, changed)
+    snapshot = {}
+    try:
+        for pdf_path in get_pdf_files_recursive(PDF_DIR): # Catch up on statements that arrived while nothing was watching
+            convert(pdf_path)
+            if observer is None:
+                snapshot[pdf_path] = pdf_signature(pdf_path)
+        logger.warning("Watching %s for new statements (%s), press Ctrl+C to stop", PDF_DIR, "file system events" if observer else f"polling every {watch_poll_seconds}s")
+
+        pending = {} # Path -> (signature, when that signature was first seen) for files that are still settling
+        last_poll = time.monotonic()
+        while True:
+            if observer is None and time.monotonic() - last_poll >= watch_poll_seconds:
+                snapshot = poll_pdf_changes(PDF_DIR, snapshot, changed)
+                last_poll = time.monotonic()
+            try:
+                pdf_path = changed.get(timeout=0.5)
+                pending.setdefault(pdf_path, None)
+                continue # Drain every queued event before checking what has settled
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for pdf_path in list(pending):
+                try:
+                    signature = pdf_signature(pdf_path)
+                except OSError: # Deleted or renamed away before it settled
+                    del pending[pdf_path]
+                    continue
+                if pending[pdf_path] is None or pending[pdf_path][0] != signature:
+                    pending[pdf_path] = (signature, now)
+                elif now - pending[pdf_path][1] >= watch_settle_seconds:
+                    del pending[pdf_path]
+                    convert(pdf_path)
+    except KeyboardInterrupt:
+        logger.warning("Stopped watching %s", PDF_DIR)
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        writer.close()
+        stop_run_logging(log_handlers)
 
 # Replace 'YOUR_PDF_DIRECTORY' and 'output_csv_file' with your desired values in the mysecrets.py file.
-try:
-    process_pdfs()
-except Exception as e:
-    if print_logs == 'on':
-        print("A PDF processing error has occurred: ", e)
-    if print_trace == 'on':
-        traceback.print_exc()
+if __name__ == "__main__": # Guarded so worker processes can import this module without starting another conversion
+    if PDF_DIR is None:
+        sys.exit("mysecrets.py not found, copy example-mysecrets.py to mysecrets.py and set PDF_DIR and CSV_FILE")
+    try:
+        if watch_mode == 'on':
+            watch_pdfs()
+        else:
+            process_pdfs()
+    except Exception as e:
+        logger.error("A PDF processing error has occurred: %s", e, exc_info=True)